@@ -0,0 +1,447 @@
+# Benchmark do downloader contra uma API e uma CDN HLS locais (sem acessar a Rocketseat)
+# Uso: python benchmark.py --workers 1,2,4,8
+# Requer FFmpeg no PATH para gerar os segmentos sintéticos de vídeo.
+import argparse
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Optional
+from urllib.parse import urlparse
+
+MAIN_PATH = Path(__file__).resolve().parent / "main.py"
+
+
+# Dados servidos pelo mock: payloads da API (sintéticos ou gravados) e segmentos HLS
+class MockPlatform:
+    def __init__(self, latency: float, bandwidth: int, error_rate: float, renditions: dict):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.payloads = {}
+        self.pages = {}
+        self.material_size = 256 * 1024  # tamanho servido em /files/ (também para os materiais gravados)
+        # Variantes da master playlist: nome -> (BANDWIDTH, RESOLUTION, segmentos)
+        self.renditions = {
+            name: (bandwidth_bits, resolution, sorted(directory.glob("seg_*.ts")))
+            for name, (bandwidth_bits, resolution, directory) in renditions.items()
+        }
+        self.segment_seconds = 4
+        # Validade do token em chamadas à API (0 = não expira), para exercitar a renovação
+        self.token_calls = 0
+        self.token = "benchmark-0"
+        self._token_uses = 0
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = {"api_calls": 0, "cdn_requests": 0, "cdn_bytes": 0, "injected_errors": 0, "token_refreshes": 0}
+
+    def count(self, key: str, amount: int = 1):
+        with self._lock:
+            self.stats[key] += amount
+
+    def issue_token(self):
+        with self._lock:
+            generation = int(self.token.rsplit("-", 1)[1]) + 1
+            self.token = f"benchmark-{generation}"
+            self._token_uses = 0
+            return self.token
+
+    def authorize(self, header: Optional[str]):
+        with self._lock:
+            if header != f"Bearer {self.token}":
+                return False
+            self._token_uses += 1
+            return not self.token_calls or self._token_uses <= self.token_calls
+
+    def build_synthetic(self, specializations: int, modules: int, groups: int, lessons: int, duration: int,
+                        materials: int = 0, material_size: int = 256 * 1024, shared: bool = False, slugs: bool = True):
+        self.material_size = material_size
+        items = []
+        for s in range(1, specializations + 1):
+            spec_slug = f"formacao-{s}"
+            items.append({"slug": spec_slug, "title": f"Formação {s}"})
+            nodes = []
+            cards = []
+            if not slugs:
+                # Módulo ainda sem página (card sem link): não pode tomar o link do card seguinte
+                nodes.append({"type": "cluster", "title": "Em breve", "course": {"title": f"Curso {s}"}})
+                cards.append('<div class="card"><h3>Em breve</h3><p>Módulo em produção.</p></div>')
+            for m in range(1, modules + 1):
+                node_slug = f"{spec_slug}-modulo-{m}"
+                # Com `shared`, todas as formações repetem os mesmos vídeos e materiais
+                asset = f"modulo-{m}" if shared else node_slug
+                nodes.append({"type": "cluster", "slug": node_slug, "title": f"Módulo {m}", "course": {"title": f"Curso {s}"}})
+                if not slugs:
+                    # Sem slug na API: o downloader precisa achar o módulo na página da jornada
+                    del nodes[-1]["slug"]
+                    if m % 2:
+                        # Layout com botão "Acessar": o título fica fora do link, no card
+                        cards.append(
+                            f'<div class="card"><h3>Módulo {m}</h3><p>Descrição do módulo sintético.</p>'
+                            f'<a class="w-full" href="/classroom/{node_slug}">Acessar</a></div>'
+                        )
+                    else:
+                        # Card inteiro dentro do link, como na página real: o título vem depois do <a>
+                        cards.append(
+                            f'<a class="w-full" href="/classroom/{node_slug}"><div class="card"><h3>Módulo {m}</h3>'
+                            f'<p>{"Descrição do módulo sintético. " * 40}</p><span>Acessar</span></div></a>'
+                        )
+                self.payloads[f"/journey-nodes/{node_slug}"] = {"cluster": {"groups": [
+                    {"title": f"Grupo {g}", "lessons": [
+                        {"id": f"{node_slug}-{g}-{l}", "last": {
+                            "title": f"Aula {l}",
+                            "description": "Aula sintética do benchmark",
+                            "duration": duration,
+                            "resource": f"{asset}-{g}-{l}",
+                            "author": {"name": "Benchmark"},
+                            "downloads": [
+                                {"title": f"Material {d}", "file_url": f"{{api}}/files/{asset}-{g}-{l}-{d}.pdf"}
+                                for d in range(1, materials + 1)
+                            ],
+                        }}
+                        for l in range(1, lessons + 1)
+                    ]}
+                    for g in range(1, groups + 1)
+                ]}}
+            self.payloads[f"/v2/journeys/{spec_slug}/progress/temp"] = {"nodes": nodes}
+            if cards:
+                self.pages[f"/journey/{spec_slug}/contents"] = f"<html><body>{''.join(cards)}</body></html>"
+        self.payloads["/catalog/list"] = {"items": items}
+
+    def load_recorded(self, cache_dir: Path):
+        """Reaproveita respostas gravadas pelo MetadataCache (pasta .cache de uma execução real)."""
+        for entry_path in cache_dir.glob("*.json"):
+            with open(entry_path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            path = urlparse(entry["url"]).path
+            if isinstance(entry["body"], str):
+                self.pages[path] = entry["body"]
+            else:
+                self.payloads[path] = self._local_materials(entry["body"])
+
+    MATERIAL_KEYS = ("file_url", "fileUrl", "url")
+
+    @classmethod
+    def _local_materials(cls, body):
+        """Aponta os materiais gravados para o /files/ do mock: os links reais iriam à plataforma."""
+        if isinstance(body, list):
+            return [cls._local_materials(item) for item in body]
+        if not isinstance(body, dict):
+            return body
+        body = {key: cls._local_materials(value) for key, value in body.items()}
+        for download in body.get("downloads") or []:
+            for key in cls.MATERIAL_KEYS:
+                if isinstance(download, dict) and isinstance(download.get(key), str) and download[key]:
+                    path = urlparse(download[key]).path or "/material"
+                    download[key] = f"{{api}}{path if path.startswith('/files/') else '/files' + path}"
+        return body
+
+
+class _Handler(BaseHTTPRequestHandler):
+    platform: MockPlatform = None
+    role = "api"
+
+    def log_message(self, format, *args):
+        pass  # o benchmark não precisa do log de acesso
+
+    def _send(self, status: int, body: bytes, content_type: str = "application/json", headers: dict = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if self.command == "HEAD":
+            return
+        if self.role == "cdn" and self.platform.bandwidth:
+            # Limita a banda por conexão, escrevendo em blocos
+            chunk_size = 64 * 1024
+            for start in range(0, len(body), chunk_size):
+                chunk = body[start:start + chunk_size]
+                self.wfile.write(chunk)
+                time.sleep(len(chunk) / self.platform.bandwidth)
+        else:
+            self.wfile.write(body)
+
+    def _json(self, data, status: int = 200):
+        self._send(status, json.dumps(data).encode("utf-8"))
+
+    def _handle(self):
+        platform = self.platform
+        time.sleep(platform.latency)
+        if platform.error_rate and random.random() < platform.error_rate:
+            platform.count("injected_errors")
+            return self._send(503, b"", headers={"Retry-After": "0"})
+        path = urlparse(self.path).path
+        if self.role == "api":
+            platform.count("api_calls")
+            return self._handle_api(path)
+        platform.count("cdn_requests")
+        return self._handle_cdn(path)
+
+    def _handle_api(self, path: str):
+        if path == "/sessions":
+            return self._json({"type": "bearer", "token": self.platform.issue_token(), "refreshToken": "benchmark"})
+        if path == "/sessions/refresh":
+            self.platform.count("token_refreshes")
+            return self._json({"type": "bearer", "token": self.platform.issue_token(), "refreshToken": "benchmark"})
+        if not self.platform.authorize(self.headers.get("Authorization")):
+            return self._json({"message": "token expired"}, 401)
+        if path == "/account":
+            return self._json({"name": "Benchmark"})
+        if path in self.platform.pages:
+            return self._send(200, self.platform.pages[path].encode("utf-8"), "text/html")
+        if path.startswith("/files/"):
+            return self._send(200, b"\0" * self.platform.material_size, "application/pdf")
+        if path.startswith("/journey/"):
+            return self._send(200, b"<html></html>", "text/html")
+        if path in self.platform.payloads:
+            # Os links dos materiais apontam para este mesmo servidor
+            body = json.dumps(self.platform.payloads[path]).replace("{api}", f"http://{self.headers['Host']}")
+            return self._send(200, body.encode("utf-8"))
+        return self._json({"message": "not found"}, 404)
+
+    def _handle_cdn(self, path: str):
+        parts = path.strip("/").split("/")
+        platform = self.platform
+        if parts[-1] == "playlist.m3u8":
+            lines = ["#EXTM3U"]
+            for name, (bandwidth, resolution, _) in platform.renditions.items():
+                lines += [f"#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},RESOLUTION={resolution}", f"{name}/video.m3u8"]
+            return self._send(200, ("\n".join(lines) + "\n").encode("utf-8"), "application/vnd.apple.mpegurl")
+        if len(parts) < 2 or parts[-2] not in platform.renditions:
+            return self._send(404, b"")
+        segments = platform.renditions[parts[-2]][2]
+        if parts[-1] == "video.m3u8":
+            lines = ["#EXTM3U", "#EXT-X-VERSION:3", f"#EXT-X-TARGETDURATION:{platform.segment_seconds}", "#EXT-X-MEDIA-SEQUENCE:0"]
+            for index in range(len(segments)):
+                lines += [f"#EXTINF:{platform.segment_seconds}.0,", f"seg_{index:03d}.ts"]
+            lines.append("#EXT-X-ENDLIST")
+            return self._send(200, ("\n".join(lines) + "\n").encode("utf-8"), "application/vnd.apple.mpegurl")
+        if parts[-1].startswith("seg_"):
+            segment = segments[int(parts[-1][4:7]) % len(segments)]
+            body = segment.read_bytes()
+            platform.count("cdn_bytes", len(body))
+            return self._send(200, body, "video/mp2t")
+        return self._send(404, b"")
+
+    do_GET = do_POST = do_HEAD = _handle
+
+
+def start_server(platform: MockPlatform, role: str):
+    handler = type(f"{role.title()}Handler", (_Handler,), {"platform": platform, "role": role})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def bitrate_bits(value: str):
+    """Converte bitrates no formato do FFmpeg ("2M", "800k") para bits/s."""
+    multiplier = {"K": 1000, "M": 1000 ** 2}.get(value[-1:].upper(), 1)
+    return int(float(value.rstrip("kKmM")) * multiplier)
+
+
+def generate_segments(target: Path, duration: int, bitrate: str, size: str = "1280x720"):
+    """Gera um vídeo de teste em HLS (segmentos de 4s) com o FFmpeg."""
+    if shutil.which("ffmpeg") is None:
+        sys.exit("ERRO: FFmpeg não encontrado no PATH; ele é necessário para gerar os segmentos do benchmark.")
+    target.mkdir(parents=True, exist_ok=True)
+    subprocess.run([
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-f", "lavfi", "-i", f"testsrc2=size={size}:rate=30:duration={duration}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}",
+        "-c:v", "libx264", "-preset", "ultrafast", "-b:v", bitrate, "-g", "120",
+        "-c:a", "aac", "-b:a", "128k",
+        "-f", "hls", "-hls_time", "4", "-hls_list_size", "0",
+        "-hls_segment_filename", str(target / "seg_%03d.ts"), str(target / "index.m3u8"),
+    ], check=True)
+
+
+def run_once(platform: MockPlatform, api_url: str, cdn_url: str, workers: int, extra_env: dict, keep: bool, hosts: int = 0):
+    """Uma execução do main.py; com `hosts`, o plano é publicado em uma fila e `hosts` workers
+    (cada um com sua pasta, como máquinas diferentes) baixam em paralelo."""
+    workdir = Path(tempfile.mkdtemp(prefix=f"bench_w{workers}{f'_h{hosts}' if hosts else ''}_"))
+    env = dict(os.environ)
+    env.update({
+        "BASE_API": api_url,
+        "BASE_URL": api_url,
+        "CDN_DOMAIN": cdn_url,
+        "SESSION_DIR": str(workdir),
+        "ROCKETSEAT_EMAIL": "benchmark@example.com",
+        "ROCKETSEAT_PASSWORD": "benchmark",
+        "DASHBOARD": "0",
+    })
+    env.update(extra_env)
+    cmd = [sys.executable, str(MAIN_PATH), "--workers", str(workers), "--formacao", "0", "--modulos", "0"]
+    if hosts:
+        env["JOB_QUEUE"] = str(workdir / "fila.db")
+        # Cada "máquina" tem sua pasta (sessão, cache, manifesto e Cursos próprios)
+        runs = [(["publish"], workdir / "coordenador")] + [(["worker"], workdir / f"host{index}") for index in range(1, hosts + 1)]
+    else:
+        runs = [([], workdir)]
+
+    platform.reset_stats()
+    start = time.perf_counter()
+    peak_rss = 0
+    returncode = 0
+    for stage in ([runs[0]], runs[1:]) if hosts else (runs,):
+        processes = []
+        for command, cwd in stage:
+            cwd.mkdir(exist_ok=True)
+            log = open(cwd / "execucao.log", "w", encoding="utf-8")
+            processes.append((subprocess.Popen(
+                cmd + command, cwd=cwd, env=dict(env, SESSION_DIR=str(cwd)), stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+            ), log))
+        for process, log in processes:
+            # wait4 devolve o uso de recursos deste processo (inclui o pico de memória)
+            _, status, usage = os.wait4(process.pid, 0)
+            log.close()
+            returncode = returncode or os.waitstatus_to_exitcode(status)
+            peak_rss = max(peak_rss, usage.ru_maxrss)
+    elapsed = time.perf_counter() - start
+
+    # Cópias transcodificadas ("Aula.hevc.mp4") não são aulas
+    lessons = sum(1 for path in workdir.rglob("Cursos/**/*.mp4") if not re.search(r"\.[a-z0-9-]+\.mp4$", path.name))
+    stats = dict(platform.stats)
+    result = {
+        "workers": workers,
+        "hosts": hosts,
+        "label": f"{hosts}x{workers}" if hosts else str(workers),
+        "returncode": returncode,
+        "seconds": round(elapsed, 2),
+        "lessons": lessons,
+        "lessons_per_min": round(lessons / elapsed * 60, 2) if elapsed else 0,
+        "mb_per_s": round(stats["cdn_bytes"] / elapsed / (1024 * 1024), 2) if elapsed else 0,
+        "api_calls_per_lesson": round(stats["api_calls"] / lessons, 3) if lessons else None,
+        "peak_rss_mb": round(peak_rss / 1024, 1),  # ru_maxrss vem em KB no Linux; maior entre os processos
+        "injected_errors": stats["injected_errors"],
+        "token_refreshes": stats["token_refreshes"],
+        "workdir": str(workdir) if keep else None,
+    }
+    if not keep:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+
+def format_table(results: list):
+    header = f"{'workers':>7} {'aulas':>6} {'tempo(s)':>9} {'aulas/min':>10} {'MB/s':>7} {'API/aula':>9} {'RSS(MB)':>8} {'erros':>6} {'rc':>3}"
+    lines = [header, "-" * len(header)]
+    for r in results:
+        lines.append(
+            f"{r.get('label', r['workers']):>7} {r['lessons']:>6} {r['seconds']:>9} {r['lessons_per_min']:>10} {r['mb_per_s']:>7} "
+            f"{r['api_calls_per_lesson'] if r['api_calls_per_lesson'] is not None else '-':>9} {r['peak_rss_mb']:>8} "
+            f"{r['injected_errors']:>6} {r['returncode']:>3}"
+        )
+    return "\n".join(lines)
+
+
+def compare_with_baseline(results: list, baseline_path: Path, tolerance: float):
+    """Retorna as regressões de aulas/min acima da tolerância em relação a um resultado salvo."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {str(r.get("label", r["workers"])): r for r in json.load(f)["results"]}
+    regressions = []
+    for result in results:
+        reference = baseline.get(result["label"])
+        if reference and reference["lessons_per_min"] and result["lessons_per_min"] < reference["lessons_per_min"] * (1 - tolerance):
+            regressions.append(
+                f"workers={result['label']}: {result['lessons_per_min']} aulas/min (antes: {reference['lessons_per_min']})"
+            )
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark do downloader com API e CDN HLS locais")
+    parser.add_argument("--workers", default="1,2,4", help="valores de --workers a comparar (ex.: 1,2,4,8)")
+    parser.add_argument("--hosts", default="0", help="máquinas simuladas no modo publish/worker (ex.: 1,2,4; 0 = execução direta)")
+    parser.add_argument("--formacoes", type=int, default=1, help="formações sintéticas")
+    parser.add_argument("--modulos", type=int, default=2, help="módulos por formação")
+    parser.add_argument("--grupos", type=int, default=2, help="grupos por módulo")
+    parser.add_argument("--aulas", type=int, default=5, help="aulas por grupo")
+    parser.add_argument("--materiais", type=int, default=0, help="materiais de apoio por aula (256 KB cada)")
+    parser.add_argument("--compartilhar", action="store_true", help="as formações repetem os mesmos vídeos e materiais (testa a deduplicação)")
+    parser.add_argument("--sem-slug", action="store_true", help="módulos sem slug na API, achados pela página da jornada")
+    parser.add_argument("--duracao", type=int, default=20, help="duração de cada aula sintética (segundos)")
+    parser.add_argument("--bitrate", default="2M", help="bitrate do vídeo sintético")
+    parser.add_argument("--variantes", action="store_true", help="master playlist com 1080p, 720p e 480p (para comparar perfis de qualidade com --env QUALITY=720p)")
+    parser.add_argument("--gravado", type=Path, default=None, help="pasta .cache com respostas reais gravadas para reproduzir")
+    parser.add_argument("--latencia", type=float, default=0.05, help="latência adicionada a cada requisição (segundos)")
+    parser.add_argument("--banda", type=float, default=0, help="banda por conexão da CDN em MB/s (0 = sem limite)")
+    parser.add_argument("--expirar", type=int, default=0, help="expira o token a cada N chamadas à API (0 = nunca)")
+    parser.add_argument("--erros", type=float, default=0.0, help="fração de respostas 503 injetadas (ex.: 0.02)")
+    parser.add_argument("--env", action="append", default=[], help="variável extra para o main.py (NOME=valor), pode repetir")
+    parser.add_argument("--saida", type=Path, default=Path("bench_output.txt"), help="arquivo com a tabela de resultados")
+    parser.add_argument("--json", type=Path, default=None, help="salva os resultados em JSON (serve de baseline)")
+    parser.add_argument("--baseline", type=Path, default=None, help="JSON de uma execução anterior para detectar regressões")
+    parser.add_argument("--tolerancia", type=float, default=0.15, help="queda máxima aceitável de aulas/min em relação ao baseline")
+    parser.add_argument("--manter", action="store_true", help="mantém as pastas de trabalho de cada execução")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    segment_dir = Path(tempfile.mkdtemp(prefix="bench_segments_"))
+    try:
+        print("Gerando segmentos HLS sintéticos...")
+        # Com --variantes, a master playlist oferece 1080p/720p/480p (2x, 1x e 0,5x o --bitrate)
+        bits = bitrate_bits(args.bitrate)
+        ladder = [("1080p", 2.0, "1920x1080"), ("720p", 1.0, "1280x720"), ("480p", 0.5, "854x480")] if args.variantes else [("720p", 1.0, "1280x720")]
+        renditions = {}
+        for name, factor, size in ladder:
+            generate_segments(segment_dir / name, args.duracao, str(int(bits * factor)), size)
+            renditions[name] = (int(bits * factor), size, segment_dir / name)
+        platform = MockPlatform(args.latencia, int(args.banda * 1024 * 1024), args.erros, renditions)
+        platform.token_calls = args.expirar
+        if args.gravado:
+            platform.load_recorded(args.gravado)
+        else:
+            platform.build_synthetic(
+                args.formacoes, args.modulos, args.grupos, args.aulas, args.duracao, args.materiais,
+                shared=args.compartilhar, slugs=not args.sem_slug,
+            )
+
+        # Hosts diferentes para a API e a CDN, assim o RateGovernor separa os orçamentos
+        api_server = start_server(platform, "api")
+        cdn_server = start_server(platform, "cdn")
+        api_url = f"http://localhost:{api_server.server_address[1]}"
+        cdn_url = f"http://127.0.0.1:{cdn_server.server_address[1]}"
+        extra_env = dict(item.split("=", 1) for item in args.env)
+
+        results = []
+        for hosts in (int(value) for value in args.hosts.split(",")):
+            for workers in (int(value) for value in args.workers.split(",")):
+                print(f"Executando com {workers} worker(s){f' em {hosts} host(s) via fila' if hosts else ''}...")
+                results.append(run_once(platform, api_url, cdn_url, workers, extra_env, args.manter, hosts))
+
+        table = format_table(results)
+        print("\n" + table)
+        args.saida.write_text(table + "\n", encoding="utf-8")
+        if args.json:
+            args.json.write_text(json.dumps({"created_at": time.time(), "args": vars(args), "results": results}, indent=2, default=str), encoding="utf-8")
+
+        if args.baseline:
+            regressions = compare_with_baseline(results, args.baseline, args.tolerancia)
+            if regressions:
+                print("\nRegressões de desempenho detectadas:")
+                for regression in regressions:
+                    print(f" - {regression}")
+                return 1
+            print("\nSem regressões em relação ao baseline.")
+        return 0
+    finally:
+        shutil.rmtree(segment_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,31 +1,105 @@
 # POC: https://gist.github.com/felipeadeildo, obrigado 🤲
 # Feito a partir de https://github.com/alefd2/script-download-lessons-rs 🚀
 # Para executar tenha Python, FFmpeg, e Yt-dlp instalados, e definidos em seu PATH no Windows!
-# Rod > pip install m3u8 requests beautifulsoup4
-# Importações úteis
+# Rod > pip install m3u8 requests
+# Importações úteis (requests, urllib3 e m3u8 são importados sob demanda: o comando `check` não precisa deles)
+import errno
 import json
 import os
-import pickle
 import re
 import time
 import shutil
+import sqlite3
 import sys
 import subprocess
+import argparse
+import hashlib
+import html
+import random
+import socket
+import threading
+import unicodedata
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import contextmanager
 from pathlib import Path
 from typing import Optional
-from urllib.parse import parse_qs
+from urllib.parse import parse_qs, urlparse
 from datetime import datetime
 
-import requests
-from bs4 import BeautifulSoup
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 
-BASE_API = "https://skylab-api.rocketseat.com.br"
-BASE_URL = "https://app.rocketseat.com.br"
-SESSION_PATH = Path(os.getenv("SESSION_DIR", ".")) / ".session.pkl"
+# Endereços da plataforma (podem apontar para um servidor local, ex.: benchmark.py)
+BASE_API = os.getenv("BASE_API", "https://skylab-api.rocketseat.com.br")
+BASE_URL = os.getenv("BASE_URL", "https://app.rocketseat.com.br")
+CDN_DOMAIN = os.getenv("CDN_DOMAIN", "vz-dc851587-83d.b-cdn.net")
+# CDN_DOMAIN pode incluir o esquema (ex.: http://127.0.0.1:8000); sem ele, usa https
+CDN_BASE_URL = CDN_DOMAIN.rstrip("/") if "://" in CDN_DOMAIN else f"https://{CDN_DOMAIN}"
+# Tokens de acesso (JSON); o .session.pkl de versões anteriores é migrado automaticamente
+SESSION_PATH = Path(os.getenv("SESSION_DIR", ".")) / ".session.json"
+LEGACY_SESSION_PATH = SESSION_PATH.with_name(".session.pkl")
 SESSION_PATH.parent.mkdir(exist_ok=True)
+# Endpoint e corpo ({"refreshToken": ...}) da renovação seguem o padrão de /sessions, mas não foram
+# confirmados na API; se a renovação falhar, o login é refeito com as credenciais do ambiente
+REFRESH_URL = os.getenv("REFRESH_URL", f"{BASE_API}/sessions/refresh")
 DEFAULT_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+# Quantidade de aulas baixadas ao mesmo tempo (independente do --concurrent-fragments do yt-dlp)
+DEFAULT_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "3"))
+# Limites das demais etapas do pipeline: arquivos .txt de metadados e materiais de apoio
+METADATA_WORKERS = int(os.getenv("METADATA_WORKERS", "2"))
+MATERIAL_WORKERS = int(os.getenv("MATERIAL_WORKERS", "2"))
+# Requisições simultâneas à API durante a fase de descoberta (módulos e journey-nodes)
+DISCOVERY_WORKERS = int(os.getenv("DISCOVERY_WORKERS", "8"))
+# Verificação dos vídeos com ffprobe em processos paralelos: duração obtida × duração da aula
+VERIFY_ENABLED = os.getenv("VERIFY", "1").lower() not in ("0", "false", "no")
+VERIFY_WORKERS = int(os.getenv("VERIFY_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+DURATION_TOLERANCE = float(os.getenv("DURATION_TOLERANCE", "2"))
+VERIFY_RETRIES = int(os.getenv("VERIFY_RETRIES", "1"))
+# Transcodificação opcional dos vídeos verificados (ex.: "hevc,mobile"; vazio = desativada). Os encoders
+# usam no máximo TRANSCODE_CPU núcleos no total, TRANSCODE_THREADS por arquivo, com prioridade baixa
+TRANSCODE = os.getenv("TRANSCODE", "")
+TRANSCODE_CPU = int(os.getenv("TRANSCODE_CPU", str(max(1, (os.cpu_count() or 2) // 2))))
+TRANSCODE_THREADS = int(os.getenv("TRANSCODE_THREADS", "2"))
+# Fila de novas tentativas para falhas transitórias: backoff exponencial a partir de RETRY_BASE_DELAY
+RETRY_ATTEMPTS = int(os.getenv("RETRY_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "30"))
+# Armazenamento deduplicado: cada vídeo/material é baixado uma vez em STORE_DIR e as
+# pastas dos cursos recebem links (hardlink, symlink ou cópia, nesta ordem com "auto")
+STORE_DIR = Path(os.getenv("STORE_DIR", ".store"))
+DEDUP_ENABLED = os.getenv("DEDUP", "1").lower() not in ("0", "false", "no")
+LINK_MODE = os.getenv("LINK_MODE", "auto").lower()
+# Cache das respostas da API (catálogo, progresso, página da jornada e journey-nodes)
+CACHE_DIR = Path(os.getenv("CACHE_DIR", ".cache"))
+CACHE_TTL = float(os.getenv("CACHE_TTL", "3600"))
+OFFLINE_MODE = os.getenv("ROCKETSEAT_OFFLINE", "").lower() in ("1", "true", "yes")
+# Manifesto com o estado de cada aula/material baixado (permite retomar execuções interrompidas)
+MANIFEST_PATH = Path(os.getenv("MANIFEST_PATH", ".manifest.db"))
+# Motor de vídeo: "native" (HLS em processo, com yt-dlp como fallback) ou "ytdlp"
+VIDEO_ENGINE = os.getenv("VIDEO_ENGINE", "native").lower()
+# Segmentos HLS baixados em paralelo por aula (equivalente ao --concurrent-fragments do yt-dlp)
+SEGMENT_WORKERS = int(os.getenv("SEGMENT_WORKERS", "10"))
+# Sincronização incremental: baixa só aulas novas ou cujo vídeo/materiais mudaram
+SYNC_MODE = os.getenv("SYNC_MODE", "").lower() in ("1", "true", "yes")
+# Pasta dos arquivos de métricas (JSON lines e formato texto do Prometheus)
+METRICS_DIR = Path(os.getenv("METRICS_DIR", "logs"))
+# Painel de progresso: "auto" (só em terminal interativo), "1" ou "0"
+DASHBOARD = os.getenv("DASHBOARD", "auto").lower()
+# HTTP/2 (multiplexação) para a CDN; requer `pip install httpx[http2]`
+HTTP2_ENABLED = os.getenv("HTTP2", "").lower() in ("1", "true", "yes")
+# Perfil de qualidade do vídeo: "best", altura máxima ("720p"), bitrate máximo ("2.5M") ou "audio"
+QUALITY = os.getenv("QUALITY", "best")
+# Modo coordenador/worker: fila de aulas em um arquivo SQLite compartilhado entre as máquinas.
+# Um worker que não renova a reserva em JOB_LEASE segundos perde a aula para outro; uma aula
+# reservada JOB_MAX_ATTEMPTS vezes sem concluir (ex.: derruba o worker) é marcada como falha
+JOB_QUEUE_PATH = Path(os.getenv("JOB_QUEUE", "fila.db"))
+JOB_LEASE = float(os.getenv("JOB_LEASE", "300"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# Disco de trabalho local: os vídeos são baixados e remuxados em SCRATCH_DIR e depois movidos para
+# o destino (ex.: um NAS) por MOVE_WORKERS movimentações em paralelo. Vazio = baixa direto no destino
+SCRATCH_DIR = Path(os.getenv("SCRATCH_DIR")) if os.getenv("SCRATCH_DIR") else None
+MOVE_WORKERS = int(os.getenv("MOVE_WORKERS", "2"))
+# Espaço livre mínimo no disco de trabalho e no destino; abaixo disso, novas aulas esperam.
+# Ativo por padrão só com SCRATCH_DIR (vazio ou 0 = sem admissão por espaço)
+MIN_FREE_SPACE = os.getenv("MIN_FREE_SPACE", "1G" if SCRATCH_DIR else "")
 
 # Função para limpar CMD
 def clear_screen():
@@ -35,6 +109,55 @@ def clear_screen():
 def sanitize_string(string: str):
     return re.sub(r'[@#$%&*/:^{}<>?"]', "", string).strip()
 
+# Converte tamanhos como "10M", "512K" ou "1.5G" (bytes) para inteiro; vazio ou 0 = sem limite
+def parse_size(value: Optional[str]):
+    if not value:
+        return 0
+    match = re.fullmatch(r"\s*([\d.]+)\s*([KMGT]?)B?\s*", value.upper())
+    if not match:
+        raise ValueError(f"Tamanho inválido: {value}")
+    multiplier = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}[match.group(2)]
+    return int(float(match.group(1)) * multiplier)
+
+# Calcula o SHA-256 de um arquivo em blocos, sem carregá-lo inteiro na memória
+def file_sha256(path, chunk_size: int = 1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Move um arquivo para outro disco sem deixar arquivo parcial no destino: copia para
+# `.moving` e renomeia no final (no mesmo disco é só um rename)
+def move_file(source: Path, dest: Path):
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.replace(source, dest)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    tmp = dest.with_name(dest.name + ".moving")
+    shutil.copyfile(source, tmp)
+    os.replace(tmp, dest)
+    os.unlink(source)
+
+# Impressão digital de uma aula: compara o recurso de vídeo, os materiais e os metadados
+def lesson_fingerprint(lesson: dict):
+    def digest(value):
+        return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    materials = sorted(
+        (download.get('file_url') or download.get('fileUrl') or download.get('url') or "", download.get('title') or download.get('name') or "")
+        for download in lesson.get('downloads') or []
+    )
+    author = lesson.get('author') if isinstance(lesson.get('author'), dict) else {}
+    return {
+        "resource": lesson.get('resource'),
+        "materials_hash": digest(materials),
+        "metadata_hash": digest([lesson.get('title'), lesson.get('description'), lesson.get('duration'), author.get('name')]),
+    }
+
 # Verificar dependências, antes de executar qualquer processo
 def check_dependencies():
     """Verifica se as dependências de linha de comando (ffmpeg, yt-dlp) estão instaladas."""
@@ -58,6 +181,502 @@ def check_dependencies():
 
     print("✓ Todas as dependências foram encontradas.")
 
+# Executada nos processos do VideoVerifier, por isso é uma função de módulo
+def probe_duration(path: str):
+    """Duração (segundos) segundo o ffprobe; None se o arquivo não puder ser lido."""
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "default=noprint_wrappers=1:nokey=1", path],
+        capture_output=True, text=True,
+    )
+    try:
+        return float(result.stdout.strip())
+    except ValueError:
+        return None
+
+# Inicializador dos processos de transcodificação: o ffmpeg herda a prioridade baixa e cede a CPU aos downloads
+def lower_priority():
+    if hasattr(os, "nice"):
+        os.nice(10)
+
+def run_ffmpeg(command: list):
+    """Executa o ffmpeg (em um processo do pool); retorna (código de saída, fim do stderr)."""
+    result = subprocess.run(command, capture_output=True, text=True)
+    return result.returncode, result.stderr.strip()[-500:]
+
+# Categorias de falha usadas no relatório, na fila de novas tentativas e no comando retry-failed
+FAILURE_CATEGORIES = {
+    "network": "Rede (transitória)",
+    "auth": "Autenticação expirada",
+    "cdn": "CDN 403/404",
+    "disk": "Disco cheio",
+    "ffmpeg": "FFmpeg",
+    "verify": "Reprovado na verificação",
+    "other": "Outros",
+}
+# Só faz sentido tentar de novo na mesma execução o que pode se resolver sozinho. Vídeo reprovado
+# na verificação já foi baixado de novo VERIFY_RETRIES vezes: a divergência costuma estar na duração
+# informada pela API, e baixar a aula inteira de novo não muda o resultado
+RETRYABLE_FAILURES = ("network", "auth", "ffmpeg")
+
+class VerificationError(RuntimeError):
+    """Vídeo reprovado na verificação com ffprobe depois de VERIFY_RETRIES novos downloads."""
+
+# Código de saída quando o modo offline (ou o `check` sem sessão salva) não acha no cache os
+# dados necessários: diferente do 10 do `check`, que significa "há novidades"
+OFFLINE_CACHE_MISS_EXIT = 3
+
+class OfflineCacheMiss(RuntimeError):
+    """Resposta ausente do cache de metadados no modo offline."""
+
+def classify_failure(error: BaseException):
+    """Classifica uma falha pela cadeia de exceções (tipo, status HTTP e mensagem)."""
+    chain = []
+    while error is not None and error not in chain:
+        chain.append(error)
+        error = error.__cause__ or error.__context__
+    for e in chain:
+        if isinstance(e, VerificationError):
+            return "verify"
+        if isinstance(e, OSError) and e.errno in (errno.ENOSPC, getattr(errno, "EDQUOT", errno.ENOSPC)):
+            return "disk"
+        status = getattr(getattr(e, "response", None), "status_code", None)
+        if status == 401:
+            return "auth"
+        if status in (403, 404, 410):
+            return "cdn"
+        if status and (status >= 500 or status == 429):
+            return "network"
+        # Exceções de requests/httpx/urllib3 reconhecidas pelo nome, sem importar as bibliotecas
+        if isinstance(e, (TimeoutError, ConnectionError)) or type(e).__name__ in (
+            "ConnectionError", "Timeout", "ReadTimeout", "ConnectTimeout", "ChunkedEncodingError",
+            "ProtocolError", "RemoteDisconnected", "IncompleteRead", "ReadError", "ConnectError",
+        ):
+            return "network"
+    text = " ".join(str(e) for e in chain).lower()
+    patterns = (
+        ("disk", r"no space left|espaço insuficiente|disk quota"),
+        ("auth", r"\b401\b|unauthorized|sessão expirada"),
+        ("cdn", r"\b40[34]\b|forbidden|not found"),
+        ("ffmpeg", r"ffmpeg|ffprobe"),
+        ("network", r"timed? ?out|connection|conexão|incompleto|incomplete|temporar"),
+    )
+    for category, pattern in patterns:
+        if re.search(pattern, text):
+            return category
+    return "other"
+
+# Importa o m3u8 só quando o motor HLS nativo é usado; sem ele o yt-dlp assume
+def load_m3u8():
+    try:
+        import m3u8
+    except ImportError:
+        return None
+    return m3u8
+
+# Percentil por interpolação linear (p entre 0 e 100)
+def percentile(values, p: float):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * p / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+# Métricas por etapa do pipeline: eventos em JSON lines e agregados em formato Prometheus
+class Metrics:
+    # Segmentos de URL mantidos no rótulo "endpoint"; o resto (slugs, ids) vira {id}
+    ENDPOINT_WORDS = {"v2", "journeys", "progress", "temp", "journey-nodes", "catalog", "list", "account", "sessions", "refresh", "journey", "contents", "classroom"}
+
+    def __init__(self, directory: Path = METRICS_DIR):
+        self.directory = Path(directory)
+        self.run_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self._observations = {}
+        self._counters = {}
+        self._events = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def endpoint(cls, url: str):
+        parsed = urlparse(url)
+        segments = []
+        for segment in parsed.path.strip("/").split("/"):
+            if segment in cls.ENDPOINT_WORDS:
+                segments.append(segment)
+            elif "." in segment:
+                segments.append("*" + os.path.splitext(segment)[1])
+            else:
+                segments.append("{id}")
+        return f"{parsed.hostname}/{'/'.join(segments)}"
+
+    @staticmethod
+    def _escape_label(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    @staticmethod
+    def _key(name: str, labels: dict):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+    def observe(self, name: str, value: float, **labels):
+        with self._lock:
+            self._observations.setdefault(self._key(name, labels), []).append(value)
+            self._events.append({"ts": time.time(), "metric": name, "value": value, **labels})
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    @contextmanager
+    def timer(self, stage: str, **labels):
+        """Mede o tempo de parede de uma etapa (ex.: discovery, video, ffmpeg, yt-dlp)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("stage_seconds", time.perf_counter() - start, stage=stage, **labels)
+
+    def values(self, name: str, **labels):
+        """Todas as observações de uma métrica cujos rótulos contêm `labels`."""
+        wanted = {(k, str(v)) for k, v in labels.items()}
+        with self._lock:
+            return [v for (n, key), values in self._observations.items() if n == name and wanted <= set(key) for v in values]
+
+    def summary(self):
+        """Linhas legíveis com contagem, total e percentis de cada etapa, para o relatório."""
+        lines = []
+        with self._lock:
+            observations = sorted(self._observations.items())
+            counters = sorted(self._counters.items())
+        for (name, labels), values in observations:
+            label = ", ".join(f"{k}={v}" for k, v in labels)
+            lines.append(
+                f"{name}{{{label}}}: n={len(values)} total={sum(values):.2f} "
+                f"p50={percentile(values, 50):.2f} p90={percentile(values, 90):.2f} p99={percentile(values, 99):.2f}"
+            )
+        for (name, labels), value in counters:
+            label = ", ".join(f"{k}={v}" for k, v in labels)
+            lines.append(f"{name}{{{label}}}: {value:.0f}")
+        return lines
+
+    def export(self):
+        """Grava metrics_<execução>.jsonl (eventos) e metrics_<execução>.prom (agregados)."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        jsonl_path = self.directory / f"metrics_{self.run_id}.jsonl"
+        prom_path = self.directory / f"metrics_{self.run_id}.prom"
+        with self._lock:
+            events, self._events = self._events, []
+            observations = sorted(self._observations.items())
+            counters = sorted(self._counters.items())
+
+        with open(jsonl_path, "a", encoding="utf-8") as f:
+            for event in events:
+                f.write(json.dumps(event, default=str) + "\n")
+
+        def labels_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{k}="{self._escape_label(v)}"' for k, v in pairs) + "}"
+
+        lines = []
+        declared = set()
+        for (name, labels), values in observations:
+            metric = f"rocketseat_{name}"
+            if metric not in declared:
+                lines.append(f"# TYPE {metric} summary")
+                declared.add(metric)
+            for q in (0.5, 0.9, 0.99):
+                lines.append(f"{metric}{labels_text(labels, [('quantile', q)])} {percentile(values, q * 100):.6f}")
+            lines.append(f"{metric}_sum{labels_text(labels)} {sum(values):.6f}")
+            lines.append(f"{metric}_count{labels_text(labels)} {len(values)}")
+        for (name, labels), value in counters:
+            metric = f"rocketseat_{name}_total"
+            if metric not in declared:
+                lines.append(f"# TYPE {metric} counter")
+                declared.add(metric)
+            lines.append(f"{metric}{labels_text(labels)} {value}")
+        with open(prom_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        return jsonl_path, prom_path
+
+
+METRICS = Metrics()
+
+# Perfil de qualidade aplicado na escolha da variante da playlist HLS (e no -f do yt-dlp).
+# Aceita "best", "audio", altura máxima ("720p"), bitrate máximo com unidade ("2.5M", "800k")
+# ou combinações separadas por vírgula ("720p,2M")
+class QualityProfile:
+    PRESETS = ("best", "1080p", "720p", "480p", "audio")
+    # Bitrate assumido para a rendição de áudio separada, que não informa BANDWIDTH
+    AUDIO_BITRATE = 128_000
+
+    def __init__(self, spec: str = "best"):
+        self.spec = spec.strip().lower() or "best"
+        self.max_height = None
+        self.max_bitrate = None
+        self.audio_only = False
+        for token in filter(None, (token.strip() for token in self.spec.split(","))):
+            if token == "best":
+                continue
+            if token in ("audio", "audio-only"):
+                self.audio_only = True
+            elif re.fullmatch(r"\d+p", token):
+                self.max_height = int(token[:-1])
+            else:
+                # Bitrate exige unidade: um número solto ("1080") é quase sempre uma altura sem o "p"
+                match = re.fullmatch(r"(\d+(?:\.\d+)?)([km])(?:bps)?", token)
+                if not match:
+                    hint = f' (altura: "{token}p"; bitrate: "{token}k")' if re.fullmatch(r"\d+", token) else ""
+                    raise ValueError(f"Perfil de qualidade inválido: {spec}{hint}")
+                self.max_bitrate = int(float(match.group(1)) * {"k": 1000, "m": 1000 ** 2}[match.group(2)])
+
+    def __str__(self):
+        return self.spec
+
+    @property
+    def is_best(self):
+        return not (self.max_height or self.max_bitrate or self.audio_only)
+
+    @property
+    def store_key(self):
+        """Sufixo da chave no armazenamento deduplicado: perfis diferentes geram arquivos diferentes."""
+        return "" if self.is_best else "." + re.sub(r"[^a-z0-9.]+", "_", self.spec)
+
+    def select(self, variants: list):
+        """Escolhe a variante (EXT-X-STREAM-INF) de maior bitrate dentro dos limites; se nenhuma
+        couber, a menor disponível. No perfil de áudio, a menor (o vídeo é descartado no remux)."""
+        def bandwidth(variant):
+            return variant.stream_info.bandwidth or 0
+
+        def fits(variant):
+            resolution = variant.stream_info.resolution
+            if self.max_height and resolution and resolution[1] > self.max_height:
+                return False
+            return not (self.max_bitrate and bandwidth(variant) > self.max_bitrate)
+
+        fitting = [] if self.audio_only else [variant for variant in variants if fits(variant)]
+        return max(fitting, key=bandwidth) if fitting else min(variants, key=bandwidth)
+
+    def estimate(self, variant, duration: Optional[float], separate_audio: bool = False):
+        """Bytes estimados (bitrate × duração) da variante escolhida; None sem bitrate ou duração."""
+        if not duration:
+            return None
+        if self.audio_only and separate_audio:
+            return int(self.AUDIO_BITRATE * duration / 8)
+        bandwidth = variant.stream_info.bandwidth if variant is not None else None
+        return int(bandwidth * duration / 8) if bandwidth else None
+
+    def ytdlp_format(self):
+        """Seletor equivalente para o -f do yt-dlp (None = escolha padrão, a melhor)."""
+        if self.is_best:
+            return None
+        if self.audio_only:
+            # A trilha de vídeo da variante "worst" é descartada depois do download
+            return "bestaudio/worst"
+        filters = ""
+        if self.max_height:
+            filters += f"[height<={self.max_height}]"
+        if self.max_bitrate:
+            filters += f"[tbr<={self.max_bitrate // 1000}]"  # tbr do yt-dlp é em kbit/s
+        return f"bv*{filters}+ba/b{filters}/wv*+ba/w"
+
+# Formata bytes e segundos para o painel de progresso
+def format_bytes(value: float):
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(value) < 1024 or unit == "GB":
+            return f"{value:.1f} {unit}"
+        value /= 1024
+
+def format_seconds(value: Optional[float]):
+    if value is None:
+        return "--:--"
+    value = int(value)
+    return f"{value // 3600}:{value % 3600 // 60:02d}:{value % 60:02d}"
+
+
+# Saída padrão enquanto o painel está ativo: apaga o painel, escreve o log e redesenha
+class _BoardStream:
+    def __init__(self, board, stream):
+        self._board = board
+        self._stream = stream
+
+    def write(self, text):
+        with self._board._lock:
+            self._board._erase()
+            self._stream.write(text)
+            if text.endswith("\n"):
+                self._board._draw()
+        return len(text)
+
+    def flush(self):
+        self._stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+# Painel de progresso ao vivo: uma linha por worker, vazão agregada e ETA da execução
+class ProgressBoard:
+    def __init__(self, mode: str = DASHBOARD, interval: float = 1.0):
+        self.mode = mode
+        self.interval = interval
+        self.rows = {}
+        self.total_lessons = 0
+        self.total_seconds = 0
+        self.done_lessons = 0
+        self.done_seconds = 0
+        self.bytes = 0
+        self.speed = 0.0
+        self.started = None
+        self._drawn_lines = 0
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stream = None
+        self._interactive = False
+
+    def start(self, total_lessons: int, total_seconds: int):
+        self.total_lessons, self.total_seconds = total_lessons, total_seconds
+        self.done_lessons = self.done_seconds = self.bytes = 0
+        self.started = time.monotonic()
+        if self.mode in ("0", "false", "no") or not total_lessons:
+            return
+        self._stream = sys.stdout
+        self._interactive = self.mode in ("1", "true", "yes") or (self.mode == "auto" and self._stream.isatty())
+        if self._interactive:
+            sys.stdout = _BoardStream(self, self._stream)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="painel", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        with self._lock:
+            self._erase()
+            if self._interactive:
+                sys.stdout = self._stream
+        self._stream.write(self._status_line() + "\n")
+
+    # --- chamadas feitas pelos workers ---
+
+    def begin(self, title: str, duration: Optional[int]):
+        with self._lock:
+            self.rows[threading.current_thread().name] = {
+                "title": title, "duration": duration or 0, "engine": "", "downloaded": 0,
+                "total": None, "speed": None, "eta": None, "started": time.monotonic(),
+            }
+
+    def end(self):
+        with self._lock:
+            self.rows.pop(threading.current_thread().name, None)
+
+    def add_total(self, seconds: int):
+        """Soma à duração total aulas que só passaram a fazer parte da execução depois do início."""
+        with self._lock:
+            self.total_seconds += seconds
+
+    def lesson_done(self, duration: Optional[int]):
+        """Aula concluída em todas as etapas do pipeline (vídeo, materiais e metadados)."""
+        with self._lock:
+            self.done_lessons += 1
+            self.done_seconds += duration or 0
+
+    def current_row(self):
+        """Linha do worker atual; threads auxiliares (ex.: segmentos HLS) recebem a linha capturada."""
+        return self.rows.get(threading.current_thread().name)
+
+    def add_bytes(self, amount: int, row: Optional[dict] = None):
+        with self._lock:
+            self.bytes += amount
+            if row is not None:
+                row["downloaded"] += amount
+
+    def update(self, row: Optional[dict], downloaded=None, total=None, speed=None, eta=None, engine=None):
+        if row is None:
+            return
+        with self._lock:
+            if downloaded is not None:
+                # Bytes do yt-dlp chegam como valor acumulado: soma só a diferença no total
+                self.bytes += max(0, downloaded - row["downloaded"])
+                row["downloaded"] = downloaded
+            if total is not None:
+                row["total"] = total
+            if speed is not None:
+                row["speed"] = speed
+            if eta is not None:
+                row["eta"] = eta
+            if engine is not None:
+                row["engine"] = engine
+
+    # --- renderização ---
+
+    def _run_eta(self):
+        elapsed = time.monotonic() - self.started
+        # Aulas em andamento contam proporcionalmente aos bytes já recebidos
+        partial = sum(
+            row["duration"] * min(1.0, row["downloaded"] / row["total"])
+            for row in self.rows.values() if row["total"]
+        )
+        done = self.done_seconds + partial
+        if done <= 0 or elapsed <= 0:
+            return None
+        return (self.total_seconds - done) / (done / elapsed)
+
+    def _status_line(self):
+        return (
+            f"Total: {self.done_lessons}/{self.total_lessons} aulas | {format_bytes(self.bytes)} | "
+            f"{format_bytes(self.speed)}/s | ETA da execução: {format_seconds(self._run_eta())}"
+        )
+
+    def _lines(self):
+        lines = []
+        for name, row in sorted(self.rows.items()):
+            total = f" / {format_bytes(row['total'])}" if row["total"] else ""
+            speed = f"{format_bytes(row['speed'])}/s" if row["speed"] else "--"
+            lines.append(
+                f"[{name}] {row['title'][:40]:<40} {format_bytes(row['downloaded'])}{total} "
+                f"{speed} ETA {format_seconds(row['eta'])} {row['engine']}"
+            )
+        lines.append(self._status_line())
+        return lines
+
+    def _erase(self):
+        if self._interactive and self._drawn_lines:
+            self._stream.write(f"\x1b[{self._drawn_lines}F\x1b[J")
+            self._drawn_lines = 0
+
+    def _draw(self):
+        if self._interactive:
+            lines = self._lines()
+            self._stream.write("\n".join(lines) + "\n")
+            self._stream.flush()
+            self._drawn_lines = len(lines)
+
+    def _loop(self):
+        last_bytes, last_time, last_print = 0, time.monotonic(), 0.0
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                now = time.monotonic()
+                # Média móvel exponencial da vazão agregada
+                instant = (self.bytes - last_bytes) / (now - last_time)
+                self.speed = instant if not self.speed else 0.7 * self.speed + 0.3 * instant
+                last_bytes, last_time = self.bytes, now
+                if self._interactive:
+                    self._erase()
+                    self._draw()
+                elif now - last_print >= 30:
+                    # Fora de um terminal (ex.: cron), apenas uma linha de status periódica
+                    self._stream.write(self._status_line() + "\n")
+                    last_print = now
+
+
+PROGRESS = ProgressBoard()
+
 # Classe para criar reportes de download, em tempo de execução
 class DownloadReport:
     def __init__(self):
@@ -65,28 +684,60 @@ class DownloadReport:
         self.failed_downloads = []
         self.start_time = None
         self.end_time = None
+        self.changes = None  # resumo da sincronização incremental, quando usada
+        self.quality = None  # perfil de qualidade dos vídeos, quando diferente do padrão
+        self.transcodes = []  # cópias geradas pela transcodificação nesta execução
+        # Os workers do agendador registram resultados em paralelo
+        self._lock = threading.Lock()
     
     def start(self):
         self.start_time = datetime.now()
         print(f"Início do download: {self.start_time.strftime('%d/%m/%Y %H:%M:%S')}")
     
-    def add_success(self, module_title, lesson_title):
-        self.successful_downloads.append({
-            'module': module_title,
-            'lesson': lesson_title,
-            'timestamp': datetime.now()
-        })
-        print(f"✓ Aula baixada com sucesso: {module_title} - {lesson_title}")
+    def add_success(self, module_title, lesson_title, order=None, engine=None, elapsed=None, size=None):
+        with self._lock:
+            self.successful_downloads.append({
+                'module': module_title,
+                'lesson': lesson_title,
+                'order': order,
+                'engine': engine,
+                'elapsed': elapsed,
+                'size': size,
+                'timestamp': datetime.now()
+            })
+            print(f"✓ Aula baixada com sucesso: {module_title} - {lesson_title}")
     
-    def add_failure(self, module_title, lesson_title, error):
-        self.failed_downloads.append({
-            'module': module_title,
-            'lesson': lesson_title,
-            'error': str(error),
-            'timestamp': datetime.now()
-        })
-        print(f"✗ Erro ao baixar aula: {module_title} - {lesson_title}")
-        print(f"   Erro: {str(error)}")
+    def add_failure(self, module_title, lesson_title, error, order=None, category=None):
+        with self._lock:
+            self.failed_downloads.append({
+                'module': module_title,
+                'lesson': lesson_title,
+                'error': str(error),
+                'category': category,
+                'order': order,
+                'timestamp': datetime.now()
+            })
+            print(f"✗ Erro ao baixar aula: {module_title} - {lesson_title}")
+            print(f"   Erro: {str(error)}")
+
+    def add_transcode(self, preset, source_size, size, elapsed, duration=None):
+        with self._lock:
+            self.transcodes.append({
+                'preset': preset,
+                'source_size': source_size,
+                'size': size,
+                'elapsed': elapsed,
+                'duration': duration,
+            })
+
+    def set_changes(self, changes: dict):
+        """Registra o resultado do diff da sincronização: {tipo: [descrição das aulas]}."""
+        self.changes = changes
+
+    @staticmethod
+    def _ordered(downloads):
+        # Com downloads paralelos a ordem de conclusão varia; o relatório segue a ordem do curso
+        return sorted(downloads, key=lambda d: d['order'] if d['order'] is not None else ())
     
     def finish(self):
         self.end_time = datetime.now()
@@ -106,20 +757,97 @@ class DownloadReport:
             f"Total de aulas: {total_attempts}",
             f"Aulas baixadas com sucesso: {len(self.successful_downloads)}",
             f"Aulas com erro: {len(self.failed_downloads)}",
-            "\n=== AULAS BAIXADAS COM SUCESSO ==="
         ]
-        
+        if self.quality:
+            report.append(f"Perfil de qualidade: {self.quality}")
+
+        # Vazão por motor de vídeo, para comparar o HLS nativo com o yt-dlp
+        hours = duration.total_seconds() / 3600
+        if hours > 0:
+            report.append(f"Aulas por hora: {len(self.successful_downloads) / hours:.1f}")
+        engines = {}
         for download in self.successful_downloads:
+            if download.get('engine'):
+                engines.setdefault(download['engine'], []).append(download['elapsed'] or 0)
+        for engine, times in sorted(engines.items()):
+            average = sum(times) / len(times)
+            report.append(f"Motor {engine}: {len(times)} vídeos | média {average:.1f}s por vídeo | {3600 / average if average else 0:.1f} vídeos/hora por worker")
+
+        # Percentis de vazão por aula (só aulas com vídeo efetivamente baixado nesta execução)
+        throughputs = [
+            d['size'] / d['elapsed'] / (1024 * 1024)
+            for d in self.successful_downloads if d.get('size') and d.get('elapsed')
+        ]
+        if throughputs:
+            total_mb = sum(d['size'] for d in self.successful_downloads if d.get('size')) / (1024 * 1024)
+            report.append(f"Total transferido em vídeos: {total_mb:.1f} MB")
+            report.append(
+                f"Vazão por aula (MB/s): p50 {percentile(throughputs, 50):.2f} | "
+                f"p90 {percentile(throughputs, 90):.2f} | p99 {percentile(throughputs, 99):.2f}"
+            )
+
+        # Tamanho das cópias em relação aos originais e velocidade dos encoders (× tempo real)
+        if self.transcodes:
+            report.append("\n=== TRANSCODIFICAÇÃO ===")
+            presets = {}
+            for transcode in self.transcodes:
+                presets.setdefault(transcode['preset'], []).append(transcode)
+            for preset, items in presets.items():
+                source_size = sum(item['source_size'] for item in items)
+                size = sum(item['size'] for item in items)
+                elapsed = sum(item['elapsed'] for item in items)
+                line = (
+                    f"{preset}: {len(items)} vídeo(s) | {format_bytes(source_size)} → {format_bytes(size)} "
+                    f"({size / source_size * 100 if source_size else 0:.0f}%) | {elapsed:.1f}s de encode"
+                )
+                timed = [item for item in items if item['duration']]
+                if timed:
+                    line += f" | {sum(item['duration'] for item in timed) / sum(item['elapsed'] for item in timed):.1f}x tempo real"
+                report.append(line)
+
+        metrics_lines = METRICS.summary()
+        if metrics_lines:
+            report.append("\n=== MÉTRICAS POR ETAPA ===")
+            report.extend(metrics_lines)
+
+        if self.changes is not None:
+            labels = {
+                "added": "Aulas novas",
+                "resource": "Vídeo alterado",
+                "materials": "Materiais alterados",
+                "metadata": "Metadados alterados",
+                "failed": "Vídeo reprovado na verificação",
+                "removed": "Aulas removidas da plataforma",
+                "unchanged": "Aulas sem alteração",
+            }
+            report.append("\n=== ALTERAÇÕES DESDE A ÚLTIMA SINCRONIZAÇÃO ===")
+            for kind, label in labels.items():
+                items = self.changes.get(kind, [])
+                report.append(f"{label}: {len(items)}")
+                if kind != "unchanged":
+                    report.extend(f"  - {item}" for item in items)
+
+        report.append("\n=== AULAS BAIXADAS COM SUCESSO ===")
+        
+        for download in self._ordered(self.successful_downloads):
             report.append(f"- Módulo: {download['module']}")
             report.append(f"  Aula: {download['lesson']}")
             report.append(f"  Horário: {download['timestamp'].strftime('%H:%M:%S')}")
         
         if self.failed_downloads:
             report.append("\n=== AULAS COM ERRO ===")
+            categories = {}
             for download in self.failed_downloads:
+                categories[download['category']] = categories.get(download['category'], 0) + 1
+            for category, count in sorted(categories.items(), key=lambda item: -item[1]):
+                report.append(f"{FAILURE_CATEGORIES.get(category, 'Sem categoria')}: {count}")
+            report.append("Para tentar somente estas aulas de novo: python main.py retry-failed\n")
+            for download in self._ordered(self.failed_downloads):
                 report.append(f"- Módulo: {download['module']}")
                 report.append(f"  Aula: {download['lesson']}")
                 report.append(f"  Erro: {download['error']}")
+                if download['category']:
+                    report.append(f"  Tipo: {FAILURE_CATEGORIES.get(download['category'], download['category'])}")
                 report.append(f"  Horário: {download['timestamp'].strftime('%H:%M:%S')}")
         
         report_text = "\n".join(report)
@@ -136,31 +864,1081 @@ class DownloadReport:
         print("="*50)
         print(f"\nRelatório salvo em: {report_path}")
 
+# Balde de tokens: `rate` tokens por segundo com rajada de até `capacity`; rate 0 = sem limite
+class TokenBucket:
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.max_rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount: float = 1):
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Pedidos maiores que a capacidade ficam "devendo" tokens e esperam proporcionalmente
+            self._tokens -= amount
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0
+        if delay:
+            time.sleep(delay)
+
+    def slow_down(self):
+        """Reduz a taxa pela metade após um 429/503 (mínimo de 10% da taxa configurada)."""
+        if self.max_rate:
+            with self._lock:
+                self.rate = max(self.max_rate * 0.1, self.rate / 2)
+
+    def speed_up(self):
+        """Recupera a taxa aos poucos enquanto as respostas estiverem saudáveis."""
+        if self.max_rate and self.rate < self.max_rate:
+            with self._lock:
+                self.rate = min(self.max_rate, self.rate * 1.05)
+
+
+# Limitador global de banda e requisições, com orçamentos separados para a API e a CDN
+class RateGovernor:
+    THROTTLE_STATUS = (429, 503)
+
+    def __init__(self):
+        self.budgets = {
+            "api": {
+                "requests": TokenBucket(float(os.getenv("API_REQUESTS_PER_SEC", "0"))),
+                "bytes": TokenBucket(parse_size(os.getenv("API_BANDWIDTH"))),
+            },
+            "cdn": {
+                "requests": TokenBucket(float(os.getenv("CDN_REQUESTS_PER_SEC", "0"))),
+                "bytes": TokenBucket(parse_size(os.getenv("CDN_BANDWIDTH"))),
+            },
+        }
+        self.total_bytes = TokenBucket(parse_size(os.getenv("MAX_BANDWIDTH")))
+        self.max_attempts = int(os.getenv("THROTTLE_RETRIES", "6"))
+        self.cdn_host = urlparse(CDN_BASE_URL).hostname
+        self._paused_until = {"api": 0.0, "cdn": 0.0}
+        self._lock = threading.Lock()
+
+    def budget_for(self, url: str):
+        host = urlparse(url).hostname or ""
+        return "cdn" if host == self.cdn_host or host.endswith(".b-cdn.net") else "api"
+
+    def bandwidth_for(self, budget: str):
+        """Limite efetivo em bytes/s para um orçamento (o menor entre ele e o global)."""
+        limits = [rate for rate in (self.budgets[budget]["bytes"].rate, self.total_bytes.rate) if rate]
+        return min(limits) if limits else 0
+
+    def consume_bytes(self, url: str, amount: int):
+        budget = self.budget_for(url)
+        METRICS.inc("bytes", amount, budget=budget)
+        self.budgets[budget]["bytes"].consume(amount)
+        self.total_bytes.consume(amount)
+
+    def _backoff(self, budget: str, response, attempt: int):
+        retry_after = response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            delay = float(retry_after)
+        else:
+            delay = min(60.0, 0.5 * 2 ** attempt) * (0.5 + random.random() / 2)
+        with self._lock:
+            # Pausa o orçamento inteiro: os outros workers também esperam em vez de insistir
+            self._paused_until[budget] = max(self._paused_until[budget], time.monotonic() + delay)
+        self.budgets[budget]["requests"].slow_down()
+        return delay
+
+    def request(self, session, method: str, url: str, **kwargs):
+        """Executa a requisição respeitando o orçamento do host e repetindo em 429/503."""
+        budget = self.budget_for(url)
+        for attempt in range(self.max_attempts):
+            pause = self._paused_until[budget] - time.monotonic()
+            if pause > 0:
+                time.sleep(pause)
+            self.budgets[budget]["requests"].consume()
+
+            request_start = time.perf_counter()
+            response = session.request(method, url, **kwargs)
+            # Latência até os cabeçalhos (o corpo de respostas em streaming é medido em bytes)
+            METRICS.observe("http_seconds", time.perf_counter() - request_start, budget=budget, endpoint=Metrics.endpoint(url))
+            METRICS.inc("http_requests", budget=budget, status=response.status_code)
+            if response.status_code not in self.THROTTLE_STATUS or attempt == self.max_attempts - 1:
+                if response.status_code not in self.THROTTLE_STATUS:
+                    self.budgets[budget]["requests"].speed_up()
+                return response
+
+            delay = self._backoff(budget, response, attempt)
+            METRICS.inc("http_retries", budget=budget, status=response.status_code)
+            print(f"\tServidor respondeu {response.status_code} ({budget}); aguardando {delay:.1f}s antes de tentar novamente")
+            response.close()
+        return response
+
+
+RATE_GOVERNOR = RateGovernor()
+
+
+# Resposta do httpx com a interface de requests usada pelos fetchers (status, headers, streaming)
+class _HTTPXResponse:
+    def __init__(self, response):
+        self._response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.url = str(response.url)
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        self._response.read()
+        return self._response.text
+
+    def json(self):
+        self._response.read()
+        return self._response.json()
+
+    def iter_content(self, chunk_size: int = 64 * 1024):
+        return self._response.iter_bytes(chunk_size)
+
+    def raise_for_status(self):
+        if not self.ok:
+            import requests
+
+            raise requests.HTTPError(f"{self.status_code} Error for url: {self.url}", response=self)
+
+    def close(self):
+        self._response.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Cliente HTTP/2 com a mesma chamada `request()` de uma requests.Session
+class _HTTPXSession:
+    def __init__(self, max_connections: int):
+        import httpx  # opcional: só é importado quando HTTP2=1
+
+        # Com transport= o httpx.Client ignora o próprio limits=: o pool é dimensionado no transporte
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self._client = httpx.Client(
+            http2=True,
+            follow_redirects=True,
+            transport=httpx.HTTPTransport(http2=True, retries=3, limits=limits),
+        )
+
+    def request(self, method: str, url: str, headers=None, params=None, timeout=None, stream: bool = False, allow_redirects: bool = True, **kwargs):
+        request = self._client.build_request(method, url, headers=headers, params=params, timeout=timeout, **kwargs)
+        response = self._client.send(request, stream=True, follow_redirects=allow_redirects)
+        if not stream:
+            response.read()
+        return _HTTPXResponse(response)
+
+    def get(self, url: str, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+
+# Camada de transporte: pools de conexão por host (API, site, CDN e materiais) dimensionados
+# pelo número de workers, compartilhados por todos os fetchers do processo
+class Transport:
+    def __init__(self, workers: int = DEFAULT_WORKERS, http2: bool = HTTP2_ENABLED):
+        self.workers = max(1, workers)
+        self.http2 = http2 and self._http2_available()
+        if http2 and not self.http2:
+            print("HTTP/2 indisponível (instale com: pip install httpx[http2]); usando HTTP/1.1 com keep-alive.")
+        self.cdn_session = self._build_cdn_session()
+
+    @staticmethod
+    def _http2_available():
+        try:
+            import h2  # noqa: F401
+            import httpx  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    @staticmethod
+    def _retries():
+        from urllib3.util.retry import Retry
+
+        # 429/503 ficam com o RateGovernor, que pausa o host inteiro e reduz a taxa
+        return Retry(
+            total=5,
+            backoff_factor=0.3,
+            status_forcelist=(500, 502, 504),
+            allowed_methods=("GET", "POST", "HEAD"),
+            respect_retry_after_header=False,
+        )
+
+    def _adapter(self, pool_maxsize: int):
+        from requests.adapters import HTTPAdapter
+
+        # pool_block evita abrir conexões extras (e novos handshakes TLS) acima do limite
+        return HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_maxsize), pool_block=True, max_retries=self._retries())
+
+    def pool_sizes(self):
+        return {
+            "api": max(DISCOVERY_WORKERS, self.workers),
+            "app": 2,
+            "cdn": self.workers * SEGMENT_WORKERS,
+            "materials": MATERIAL_WORKERS,
+        }
+
+    def configure_api_session(self, session):
+        """Monta um pool por host na sessão autenticada (também em sessões carregadas do disco)."""
+        from requests.adapters import HTTPAdapter
+
+        sizes = self.pool_sizes()
+        # Materiais podem vir de qualquer host: pool genérico, um por host encontrado
+        fallback = HTTPAdapter(pool_connections=8, pool_maxsize=sizes["materials"], max_retries=self._retries())
+        session.mount("http://", fallback)
+        session.mount("https://", fallback)
+        session.mount(BASE_API, self._adapter(sizes["api"]))
+        # Com API e app no mesmo host (ex.: um mock local), o pool da API atende os dois
+        if BASE_URL.rstrip("/") != BASE_API.rstrip("/"):
+            session.mount(BASE_URL, self._adapter(sizes["app"]))
+        return session
+
+    def _build_cdn_session(self):
+        # Sessão separada para a CDN: sem o Authorization da API e com pool para os segmentos em paralelo
+        size = self.pool_sizes()["cdn"]
+        if self.http2:
+            # Com HTTP/2 poucas conexões bastam: os segmentos são multiplexados
+            return _HTTPXSession(max_connections=max(2, self.workers))
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        session.mount(CDN_BASE_URL, self._adapter(size))
+        fallback = HTTPAdapter(pool_connections=4, pool_maxsize=size, max_retries=self._retries())
+        session.mount("https://", fallback)
+        session.mount("http://", fallback)
+        return session
+
+# Armazena token e refreshToken em JSON e renova o acesso uma única vez quando vários workers recebem 401
+class TokenStore:
+    def __init__(self, path: Path = SESSION_PATH):
+        self.path = path
+        self.token = None
+        self.token_type = "Bearer"
+        self.refresh_token = None
+        # Incrementado a cada token novo: quem recebeu 401 com um token antigo só repete a requisição
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._load()
+
+    @property
+    def exists(self):
+        return bool(self.token)
+
+    def _load(self):
+        if self.path.exists():
+            try:
+                data = json.loads(self.path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                print(f"Arquivo de sessão inválido ({self.path}); será necessário fazer login novamente.")
+                return
+            self.token = data.get("token")
+            self.token_type = data.get("type") or "Bearer"
+            self.refresh_token = data.get("refreshToken")
+        elif LEGACY_SESSION_PATH.exists():
+            self._migrate_legacy()
+
+    def _migrate_legacy(self):
+        """Extrai os tokens do requests.Session serializado com pickle pelas versões anteriores."""
+        import pickle
+
+        try:
+            with LEGACY_SESSION_PATH.open("rb") as f:
+                legacy = pickle.load(f)
+            authorization = legacy.headers.get("Authorization", "")
+            token_type, _, token = authorization.partition(" ")
+            self.token = token or legacy.cookies.get("skylab_next_access_token_v4")
+            self.token_type = token_type if token else "Bearer"
+            self.refresh_token = legacy.cookies.get("skylab_next_refresh_token_v4")
+        except Exception as e:
+            print(f"Não foi possível migrar {LEGACY_SESSION_PATH}: {e}")
+            return
+        if self.token:
+            self._save()
+            LEGACY_SESSION_PATH.unlink()
+            print(f"Sessão migrada para {self.path}.")
+
+    def _save(self):
+        data = {"type": self.token_type, "token": self.token, "refreshToken": self.refresh_token}
+        tmp = self.path.with_suffix(".tmp")
+        # Criado já com 0600: o token nunca fica legível por outros usuários, nem por um instante
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            file.write(json.dumps(data))
+        os.replace(tmp, self.path)
+
+    def update(self, data: dict):
+        """Grava a resposta de /sessions (ou do refresh): type, token e refreshToken."""
+        self.token = data["token"]
+        self.token_type = (data.get("type") or self.token_type).capitalize()
+        self.refresh_token = data.get("refreshToken") or self.refresh_token
+        self.generation += 1
+        self._save()
+
+    def apply(self, session):
+        if not self.token:
+            return
+        session.headers["Authorization"] = f"{self.token_type} {self.token}"
+        session.cookies.set("skylab_next_access_token_v4", self.token)
+        if self.refresh_token:
+            session.cookies.set("skylab_next_refresh_token_v4", self.refresh_token)
+
+    def refresh(self, session, seen_generation: int, fallback=None):
+        """Renova o token com o refreshToken (ou, se falhar, com `fallback`, ex.: novo login).
+        Retorna True se a requisição pode ser repetida."""
+        with self._lock:
+            if self.generation != seen_generation:
+                return True  # outro worker já renovou enquanto esperávamos o lock
+            if self.refresh_token:
+                print("Token expirado; renovando a sessão...")
+                res = RATE_GOVERNOR.request(session, "POST", REFRESH_URL, json={"refreshToken": self.refresh_token}, timeout=DEFAULT_TIMEOUT)
+                if res.ok:
+                    self.update(res.json())
+                    self.apply(session)
+                    METRICS.inc("token_refreshes")
+                    return True
+                print(f"Falha ao renovar a sessão ({res.status_code}).")
+            return bool(fallback and fallback())
+
+
+# Cache em disco das respostas da API, com TTL e revalidação por ETag/Last-Modified
+class MetadataCache:
+    def __init__(self, directory: Path = CACHE_DIR, ttl: float = CACHE_TTL):
+        self.directory = Path(directory)
+        self.ttl = ttl
+
+    def _path(self, url: str, params: Optional[dict] = None):
+        key = url + "?" + json.dumps(params or {}, sort_keys=True)
+        return self.directory / f"{hashlib.sha256(key.encode('utf-8')).hexdigest()}.json"
+
+    def load(self, url: str, params: Optional[dict] = None):
+        path = self._path(url, params)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def is_fresh(self, entry: dict):
+        return time.time() - entry.get("fetched_at", 0) < self.ttl
+
+    def store(self, url: str, params: Optional[dict], body, etag=None, last_modified=None):
+        entry = {
+            "url": url,
+            "params": params,
+            "fetched_at": time.time(),
+            "etag": etag,
+            "last_modified": last_modified,
+            "body": body,
+        }
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._path(url, params)
+        # Escrita atômica: workers da descoberta podem gravar ao mesmo tempo
+        tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+        return entry
+
+    def touch(self, entry: dict):
+        """Marca uma entrada revalidada (HTTP 304) como recente."""
+        return self.store(entry["url"], entry["params"], entry["body"], entry.get("etag"), entry.get("last_modified"))
+
+# Índice dos links /classroom/ da página da jornada, montado em uma única passada pelo HTML.
+# Cada link guarda o slug, a posição na página, o título do card (último heading antes do link),
+# o texto do card e os ids (UUIDs) encontrados nele, para casar módulos sem slug por id ou título
+class JourneyIndex:
+    TOKEN = re.compile(
+        r'<h[1-6]\b[^>]*>(?P<heading>.*?)</h[1-6]>'
+        r'|<a\b(?P<attrs>[^>]*?)\bhref="/classroom/(?P<slug>[^"?#/]+)[^"]*"(?P<rest>[^>]*)>'
+        r'|(?P<close></a\s*>)',
+        re.S | re.I,
+    )
+    UUID = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}", re.I)
+    TAG = re.compile(r"<[^>]*>")
+    # Texto do card guardado por link (o suficiente para conter o título do módulo) e o trecho
+    # do HTML do card de onde ele é extraído, para não normalizar descrições longas inteiras
+    TEXT_LIMIT = 400
+    CARD_TAIL = 4000
+    METHODS = {"id": "id do nó", "title": "título", "order": "ordem"}
+    # Versão do formato do índice guardado no cache: muda quando a leitura da página muda
+    VERSION = 3
+
+    def __init__(self, links: list):
+        self.links = links
+
+    @classmethod
+    def normalize(cls, text: str):
+        """Texto comparável: sem tags, entidades HTML, acentos, pontuação e diferenças de caixa."""
+        text = unicodedata.normalize("NFKD", html.unescape(cls.TAG.sub(" ", text or "")))
+        text = text.encode("ascii", "ignore").decode("ascii")  # remove os acentos decompostos pelo NFKD
+        return " ".join(re.sub(r"[\W_]+", " ", text.lower()).split())
+
+    @classmethod
+    def parse(cls, html_content: str):
+        """Card de cada link: o conteúdo do próprio <a> (cards inteiros costumam ser o link) ou,
+        se o link não tem heading (ex.: botão "Acessar"), também o trecho desde o heading do card."""
+        links = []
+        by_slug = {}
+        heading = ""  # último heading fora de um link, candidato a título do próximo card
+        card_start = 0  # início do card: o último heading fora de um link ou o fim do link anterior
+        anchor = None  # link /classroom/ aberto e o primeiro heading dentro dele
+        inner_heading = ""
+
+        def add(anchor, end, inner_heading):
+            before = html_content[card_start:anchor.start()]
+            inner = html_content[anchor.end():end]
+            title = inner_heading or heading
+            text = cls.normalize(inner[:cls.CARD_TAIL])[:cls.TEXT_LIMIT]
+            if not inner_heading:
+                # Link sem heading (ex.: botão "Acessar"): o título do card vem antes dele
+                text = f"{text} {cls.normalize(before[-cls.CARD_TAIL:])[-cls.TEXT_LIMIT:]}".strip()
+            ids = sorted({
+                value.lower() for value in cls.UUID.findall(before + anchor.group("attrs") + anchor.group("rest") + inner)
+            })
+            slug = anchor.group("slug")
+            if slug in by_slug:
+                # Outro link para o mesmo módulo (ex.: imagem e botão do mesmo card)
+                link = by_slug[slug]
+                link["ids"] = sorted(set(link["ids"]) | set(ids))
+                if not link["title"]:
+                    link.update(title=title, text=link["text"] or text)
+                return
+            by_slug[slug] = {"slug": slug, "position": anchor.start(), "title": title, "text": text, "ids": ids}
+            links.append(by_slug[slug])
+
+        for match in cls.TOKEN.finditer(html_content):
+            if match.group("heading") is not None:
+                if anchor is not None:
+                    inner_heading = inner_heading or cls.normalize(match.group("heading"))
+                else:
+                    # Um card sem link antes deste não pode emprestar o seu título (nem ids) a ele
+                    heading, card_start = cls.normalize(match.group("heading")), match.start()
+                continue
+            if match.group("close") is not None and anchor is None:
+                continue  # fim de um link que não é de módulo
+            if anchor is not None:
+                # Fim do link (ou outro link aberto sem fechar o anterior)
+                add(anchor, match.start(), inner_heading)
+                heading, card_start, anchor = "", match.end() if match.group("close") else match.start(), None
+            if match.group("slug") is not None:
+                anchor, inner_heading = match, ""
+        if anchor is not None:
+            add(anchor, min(len(html_content), anchor.end() + cls.CARD_TAIL), inner_heading)
+        return cls(links)
+
+    def match(self, modules: list, known_slugs=()):
+        """Casa cada módulo com um link: pelo id do nó, depois pelo título. A ordem da página só é
+        usada para os que sobrarem quando as quantidades batem (um link ausente não desloca os demais).
+        Retorna {índice do módulo: (slug, método)}."""
+        available = [link for link in self.links if link["slug"] not in set(known_slugs)]
+        used = set()
+        matches = {}
+
+        def take(index, link, method):
+            matches[index] = (link["slug"], method)
+            used.add(link["slug"])
+
+        for index, module in enumerate(modules):
+            node_ids = {str(module[key]).lower() for key in ("id", "node_id", "nodeId") if module.get(key)}
+            link = next((link for link in available if link["slug"] not in used and (node_ids & set(link["ids"]) or link["slug"] in node_ids)), None)
+            if link is not None:
+                take(index, link, "id")
+
+        # Pelo título só quando não há ambiguidade: um único módulo com o título e um único card com ele
+        titles = {}
+        for index, module in enumerate(modules):
+            if index not in matches:
+                title = self.normalize(module.get("title"))
+                titles[title] = titles.get(title, 0) + 1
+        # Primeiro os títulos exatos de todos os módulos; só então o texto dos cards, para que um
+        # módulo sem card não tome, pelo texto, o card que tem o título exato de outro
+        for exact in (True, False):
+            for index, module in enumerate(modules):
+                title = self.normalize(module.get("title"))
+                if index in matches or not title or titles[title] > 1:
+                    continue
+                candidates = [link for link in available if link["slug"] not in used]
+                if exact:
+                    found = [link for link in candidates if link["title"] == title]
+                else:
+                    # Título fora de um heading: procura no texto do card, como palavra inteira
+                    pattern = re.compile(rf"(?:^| ){re.escape(title)}(?: |$)")
+                    found = [link for link in candidates if pattern.search(link["text"])]
+                if len(found) == 1:
+                    take(index, found[0], "title")
+
+        remaining = [index for index in range(len(modules)) if index not in matches]
+        unused = [link for link in available if link["slug"] not in used]
+        if remaining and len(remaining) == len(unused):
+            for index, link in zip(remaining, unused):
+                take(index, link, "order")
+        return matches
+
+# Manifesto durável (SQLite) com uma linha por aula e por material
+class DownloadManifest:
+    PENDING = "pending"
+    DOWNLOADING = "downloading"
+    DONE = "done"
+    FAILED = "failed"
+
+    # Colunas da tabela "items"; colunas novas são adicionadas a manifestos antigos no carregamento
+    COLUMNS = (
+        ("path", "TEXT PRIMARY KEY"),
+        ("kind", "TEXT NOT NULL"),
+        ("resource_id", "TEXT"),
+        ("expected_size", "INTEGER"),
+        ("expected_duration", "INTEGER"),
+        ("size", "INTEGER"),
+        ("checksum", "TEXT"),
+        ("state", "TEXT NOT NULL"),
+        ("updated_at", "REAL NOT NULL"),
+        ("etag", "TEXT"),
+        ("probed_duration", "REAL"),
+        ("verified_at", "REAL"),
+        ("quality", "TEXT"),  # perfil de qualidade usado no download do vídeo
+    )
+
+    def __init__(self, path: Path = MANIFEST_PATH):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        columns_sql = ", ".join(f"{name} {kind}" for name, kind in self.COLUMNS)
+        self._conn.execute(f"CREATE TABLE IF NOT EXISTS items ({columns_sql})")
+        existing = {row[1] for row in self._conn.execute("PRAGMA table_info(items)")}
+        for name, kind in self.COLUMNS:
+            if name not in existing:
+                self._conn.execute(f"ALTER TABLE items ADD COLUMN {name} {kind}")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS fingerprints (
+                lesson_key TEXT PRIMARY KEY,
+                module_path TEXT,
+                resource TEXT,
+                materials_hash TEXT,
+                metadata_hash TEXT,
+                seen_at REAL NOT NULL
+            )
+            """
+        )
+        # Índice reverso do armazenamento deduplicado: onde cada arquivo do store é usado
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS refs (
+                path TEXT PRIMARY KEY,
+                store_path TEXT NOT NULL,
+                link_mode TEXT,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS refs_store_path ON refs (store_path)")
+        # Aulas que terminaram com falha, com o job serializado para o comando retry-failed
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS failures (
+                lesson_key TEXT PRIMARY KEY,
+                job TEXT NOT NULL,
+                category TEXT,
+                error TEXT,
+                attempts INTEGER,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+        # Carrega todas as linhas uma única vez: o reinício consulta a memória, não o disco
+        self._names = [name for name, _ in self.COLUMNS]
+        self._rows = {
+            row[0]: dict(zip(self._names, row))
+            for row in self._conn.execute(f"SELECT {', '.join(self._names)} FROM items")
+        }
+
+    def get(self, path):
+        with self._lock:
+            return self._rows.get(str(path))
+
+    def is_done(self, path, resource_id: Optional[str] = None, quality: Optional[str] = None):
+        row = self.get(path)
+        if not row or row["state"] != self.DONE:
+            return False
+        # Perfil de qualidade diferente: o arquivo não serve para o perfil pedido. Linhas anteriores
+        # à coluna "quality" foram baixadas no perfil padrão
+        if quality is not None and (row.get("quality") or "best") != quality:
+            return False
+        # Se o recurso mudou (ex.: vídeo regravado), a linha antiga não vale mais
+        return resource_id is None or row["resource_id"] == resource_id
+
+    def mark(self, path, kind: str, state: str, **fields):
+        path = str(path)
+        with self._lock:
+            row = dict(self._rows.get(path) or dict.fromkeys(self._names, None))
+            if state == self.DOWNLOADING:
+                # Arquivo novo: a verificação anterior não vale mais
+                row.update(probed_duration=None, verified_at=None)
+            row.update(fields)
+            row.update(path=path, kind=kind, state=state, updated_at=time.time())
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO items ({', '.join(self._names)}) VALUES ({', '.join(':' + name for name in self._names)})",
+                row,
+            )
+            self._conn.commit()
+            self._rows[path] = row
+        return row
+
+    def fingerprints(self):
+        """Impressões digitais da última sincronização, indexadas pela chave da aula."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT lesson_key, module_path, resource, materials_hash, metadata_hash FROM fingerprints"
+            ).fetchall()
+        return {row[0]: dict(zip(("lesson_key", "module_path", "resource", "materials_hash", "metadata_hash"), row)) for row in rows}
+
+    def save_fingerprint(self, lesson_key: str, module_path, fingerprint: dict):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?, ?, ?)",
+                (lesson_key, str(module_path), fingerprint["resource"], fingerprint["materials_hash"], fingerprint["metadata_hash"], time.time()),
+            )
+            self._conn.commit()
+
+    def delete_fingerprints(self, lesson_keys):
+        with self._lock:
+            self._conn.executemany("DELETE FROM fingerprints WHERE lesson_key = ?", [(key,) for key in lesson_keys])
+            self._conn.commit()
+
+    def mark_like(self, path, source):
+        """Copia o estado de `source` para `path` (ex.: link para um arquivo do store)."""
+        row = self.get(source)
+        fields = {name: value for name, value in row.items() if name not in ("path", "kind", "state", "updated_at")}
+        return self.mark(path, row["kind"], row["state"], **fields)
+
+    def add_reference(self, path, store_path, link_mode: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO refs VALUES (?, ?, ?, ?)",
+                (str(path), str(store_path), link_mode, time.time()),
+            )
+            self._conn.commit()
+
+    def reference(self, path):
+        """(store_path, link_mode) registrados para `path`, ou None."""
+        with self._lock:
+            return self._conn.execute("SELECT store_path, link_mode FROM refs WHERE path = ?", (str(path),)).fetchone()
+
+    def references(self, store_path=None):
+        """Caminhos que apontam para `store_path` (ou o índice inteiro: {store_path: [paths]})."""
+        with self._lock:
+            if store_path is not None:
+                rows = self._conn.execute("SELECT path, store_path FROM refs WHERE store_path = ?", (str(store_path),)).fetchall()
+            else:
+                rows = self._conn.execute("SELECT path, store_path FROM refs").fetchall()
+        index = {}
+        for path, target in rows:
+            index.setdefault(target, []).append(path)
+        return index.get(str(store_path), []) if store_path is not None else index
+
+    def save_failure(self, lesson_key: str, job: dict, category: str, error: str, attempts: int):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO failures VALUES (?, ?, ?, ?, ?, ?)",
+                (lesson_key, json.dumps(job), category, error, attempts, time.time()),
+            )
+            self._conn.commit()
+
+    def clear_failure(self, lesson_key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM failures WHERE lesson_key = ?", (lesson_key,))
+            self._conn.commit()
+
+    def failures(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT lesson_key, job, category, error, attempts FROM failures ORDER BY updated_at").fetchall()
+        return [
+            {"lesson_key": key, "job": json.loads(job), "category": category, "error": error, "attempts": attempts}
+            for key, job, category, error, attempts in rows
+        ]
+
+    def mark_done_from_file(self, path, kind: str, **fields):
+        """Registra um arquivo concluído com tamanho e checksum reais."""
+        with METRICS.timer("disk", op="checksum"):
+            checksum = file_sha256(path)
+        return self.mark(path, kind, self.DONE, size=os.path.getsize(path), checksum=checksum, **fields)
+
+    def rename(self, path, new_path):
+        """Leva a linha de `path` para `new_path` (arquivo movido do disco de trabalho para o destino)."""
+        with self._lock:
+            row = self._rows.pop(str(path), None)
+            if row is None:
+                return None
+            row = dict(row, path=str(new_path), updated_at=time.time())
+            self._conn.execute("DELETE FROM items WHERE path = ?", (str(path),))
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO items ({', '.join(self._names)}) VALUES ({', '.join(':' + name for name in self._names)})",
+                row,
+            )
+            self._conn.commit()
+            self._rows[str(new_path)] = row
+        return row
+
+# Controle de admissão por espaço livre: um vídeo só começa a baixar quando o disco de trabalho e
+# o destino comportam o tamanho estimado dele (bitrate × duração) além de MIN_FREE_SPACE,
+# descontando o que os vídeos em andamento ou aguardando a movimentação ainda vão ocupar
+class SpaceAdmission:
+    POLL_INTERVAL = 5.0
+
+    def __init__(self, min_free: int = 0):
+        self.min_free = min_free
+        self._reserved = {}  # dispositivo (st_dev) -> bytes reservados
+        self._active = 0  # reservas em andamento (inclusive as de tamanho desconhecido, 0 bytes)
+        self._condition = threading.Condition()
+
+    @staticmethod
+    def _existing(path: Path):
+        # A pasta de destino pode ainda não existir: o espaço é o do primeiro ancestral existente
+        path = Path(path).absolute()
+        while not path.exists() and path.parent != path:
+            path = path.parent
+        return path
+
+    def reserve(self, size: int, paths: list):
+        """Aguarda espaço em todos os discos de `paths` e reserva `size` bytes em cada um.
+        Sem nada reservado para liberar espaço, falha com ENOSPC em vez de esperar para sempre."""
+        devices = {}
+        for path in paths:
+            existing = self._existing(path)
+            devices.setdefault(existing.stat().st_dev, existing)
+        wait_start = None
+        with self._condition:
+            while True:
+                short = [
+                    path for device, path in devices.items()
+                    if shutil.disk_usage(path).free - self._reserved.get(device, 0) - size < self.min_free
+                ]
+                if not short:
+                    break
+                if not self._active:
+                    raise OSError(
+                        errno.ENOSPC,
+                        f"espaço livre insuficiente em {short[0]} para {format_bytes(size)} "
+                        f"(mínimo livre: {format_bytes(self.min_free)})",
+                    )
+                if wait_start is None:
+                    wait_start = time.perf_counter()
+                    print(f"\tEspaço livre baixo em {short[0]}; aguardando as aulas em andamento liberarem espaço...")
+                self._condition.wait(self.POLL_INTERVAL)
+            for device in devices:
+                self._reserved[device] = self._reserved.get(device, 0) + size
+            self._active += 1
+        if wait_start is not None:
+            METRICS.observe("space_wait_seconds", time.perf_counter() - wait_start)
+        return size, tuple(devices)
+
+    def release(self, reservation):
+        if reservation is None:
+            return
+        size, devices = reservation
+        with self._condition:
+            for device in devices:
+                self._reserved[device] -= size
+            self._active -= 1
+            self._condition.notify_all()
+
+# Armazenamento endereçado por conteúdo: vídeos pelo id do recurso e materiais pela URL
+class ContentStore:
+    def __init__(self, directory: Path = STORE_DIR, link_mode: str = LINK_MODE):
+        self.directory = Path(directory)
+        self.link_mode = link_mode
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def path_for(self, kind: str, key: str, suffix: str = ""):
+        if kind == "video":
+            return self.directory / "videos" / f"{sanitize_string(key)}{suffix}"
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return self.directory / "materials" / digest[:2] / f"{digest}{suffix}"
+
+    @contextmanager
+    def lock(self, store_path: Path):
+        """Um download por arquivo do store: quem chega depois espera e só cria o link."""
+        with self._locks_guard:
+            lock = self._locks.setdefault(str(store_path), threading.Lock())
+        with lock:
+            store_path.parent.mkdir(parents=True, exist_ok=True)
+            yield
+
+    def link(self, store_path: Path, dest: Path):
+        """Cria `dest` apontando para `store_path`; retorna o tipo de link usado."""
+        if dest.exists() and os.path.samefile(store_path, dest):
+            return "hardlink" if not dest.is_symlink() else "symlink"
+        modes = ("hardlink", "symlink", "copy") if self.link_mode == "auto" else (self.link_mode,)
+        tmp = dest.with_name(dest.name + ".link")
+        for mode in modes:
+            if tmp.exists() or tmp.is_symlink():
+                tmp.unlink()
+            try:
+                if mode == "hardlink":
+                    os.link(store_path, tmp)
+                elif mode == "symlink":
+                    # Relativo: a pasta do projeto pode ser movida sem quebrar os links
+                    os.symlink(os.path.relpath(store_path.resolve(), dest.parent.resolve()), tmp)
+                else:
+                    shutil.copy2(store_path, tmp)
+            except OSError:
+                continue  # ex.: outro sistema de arquivos (hardlink) ou Windows sem permissão (symlink)
+            os.replace(tmp, dest)
+            return mode
+        raise OSError(f"não foi possível criar {dest} a partir de {store_path} (LINK_MODE={self.link_mode})")
+
+    def adopt(self, existing: Path, store_path: Path):
+        """Leva para o store um arquivo baixado antes da deduplicação, sem baixar de novo."""
+        try:
+            os.link(existing, store_path)
+        except OSError:
+            os.replace(existing, store_path)
+            self.link(store_path, existing)
+
+# Fila de aulas compartilhada entre máquinas (modo coordenador/worker). O coordenador publica
+# o plano da descoberta; cada worker reserva aulas com uma reserva (lease) renovada por heartbeat.
+# O arquivo pode ficar em um compartilhamento de rede: sem WAL (não funciona em NFS/SMB) e com
+# transações curtas em BEGIN IMMEDIATE, para que duas máquinas nunca reservem a mesma aula
+class JobQueue:
+    PENDING = "pending"
+    LEASED = "leased"
+    DONE = "done"
+    FAILED = "failed"
+    # Intervalo máximo entre consultas de um worker ocioso (ou com o pipeline cheio)
+    POLL_INTERVAL = 5.0
+
+    def __init__(self, path: Path = JOB_QUEUE_PATH, lease: float = JOB_LEASE, max_attempts: int = JOB_MAX_ATTEMPTS):
+        self.path = Path(path)
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        # isolation_level=None: as transações são abertas explicitamente em _transaction
+        self._conn = sqlite3.connect(str(self.path), timeout=60, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=DELETE")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                key TEXT PRIMARY KEY,
+                position INTEGER NOT NULL,
+                job TEXT NOT NULL,
+                fingerprint TEXT,
+                state TEXT NOT NULL,
+                owner TEXT,
+                lease_until REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, position)")
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def publish(self, jobs: list):
+        """Publica as aulas (já serializadas) na ordem do plano. Aulas concluídas continuam concluídas,
+        a menos que a impressão digital tenha mudado; as que falharam voltam para a fila."""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.executemany(
+                """
+                INSERT INTO jobs (key, position, job, fingerprint, state, updated_at) VALUES (?, ?, ?, ?, 'pending', ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    position = excluded.position,
+                    job = excluded.job,
+                    fingerprint = excluded.fingerprint,
+                    state = CASE
+                        WHEN jobs.state = 'failed' OR (jobs.state = 'done' AND jobs.fingerprint IS NOT excluded.fingerprint)
+                        THEN 'pending' ELSE jobs.state END,
+                    attempts = CASE
+                        WHEN jobs.state = 'failed' OR (jobs.state = 'done' AND jobs.fingerprint IS NOT excluded.fingerprint)
+                        THEN 0 ELSE jobs.attempts END,
+                    updated_at = excluded.updated_at
+                """,
+                [
+                    (job["key"], position, json.dumps(job, ensure_ascii=False),
+                     json.dumps(lesson_fingerprint(job["lesson"]), sort_keys=True), now)
+                    for position, job in enumerate(jobs)
+                ],
+            )
+        return self.counts()
+
+    def claim(self, owner: str, limit: int):
+        """Reserva até `limit` aulas pendentes (ou com reserva vencida, de um worker que caiu).
+        Aulas que já esgotaram as tentativas são marcadas como falha em vez de reservadas de novo."""
+        if limit <= 0:
+            return []
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET state = 'failed', error = ?, lease_until = NULL, updated_at = ? "
+                "WHERE attempts >= ? AND (state = 'pending' OR (state = 'leased' AND lease_until < ?))",
+                (f"reserva vencida em {self.max_attempts} tentativa(s)", now, self.max_attempts, now),
+            )
+            rows = conn.execute(
+                "SELECT key, job FROM jobs WHERE state = 'pending' OR (state = 'leased' AND lease_until < ?) "
+                "ORDER BY position LIMIT ?",
+                (now, limit),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE jobs SET state = 'leased', owner = ?, lease_until = ?, attempts = attempts + 1, updated_at = ? WHERE key = ?",
+                [(owner, now + self.lease, now, key) for key, _ in rows],
+            )
+        return [json.loads(job) for _, job in rows]
+
+    def heartbeat(self, owner: str, keys: list):
+        """Renova as reservas do worker; retorna as aulas que ele perdeu para outro worker."""
+        if not keys:
+            return []
+        now = time.time()
+        with self._transaction() as conn:
+            conn.executemany(
+                "UPDATE jobs SET lease_until = ?, updated_at = ? WHERE key = ? AND owner = ? AND state = 'leased'",
+                [(now + self.lease, now, key, owner) for key in keys],
+            )
+            placeholders = ", ".join("?" * len(keys))
+            held = {row[0] for row in conn.execute(
+                f"SELECT key FROM jobs WHERE owner = ? AND state = 'leased' AND key IN ({placeholders})", (owner, *keys),
+            )}
+        return [key for key in keys if key not in held]
+
+    def complete(self, key: str, owner: str, error: Optional[str] = None):
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET state = ?, error = ?, lease_until = NULL, updated_at = ? WHERE key = ? AND owner = ?",
+                (self.FAILED if error else self.DONE, error, time.time(), key, owner),
+            )
+
+    def counts(self):
+        """Quantidade de aulas por estado; reservas vencidas contam como pendentes."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT CASE WHEN state = 'leased' AND lease_until < ? THEN 'pending' ELSE state END, COUNT(*) "
+                "FROM jobs GROUP BY 1",
+                (time.time(),),
+            ).fetchall()
+        counts = dict.fromkeys((self.PENDING, self.LEASED, self.DONE, self.FAILED), 0)
+        counts.update(rows)
+        return counts
+
 # Baixar usando CDN [mais preciso]
 class CDNVideo:
-    def __init__(self, video_id: str, save_path: str):
+    engine = "yt-dlp"
+    # Uma linha por atualização (--newline), em formato fácil de interpretar
+    PROGRESS_TEMPLATE = "download:PROGRESS %(progress.downloaded_bytes)s %(progress.total_bytes_estimate)s %(progress.speed)s %(progress.eta)s"
+    # Quantidade de aulas simultâneas; usada para dividir o limite de banda entre os yt-dlp
+    workers = DEFAULT_WORKERS
+
+    def __init__(self, video_id: str, save_path: str, manifest: Optional[DownloadManifest] = None, duration: Optional[int] = None,
+                 profile: Optional[QualityProfile] = None, admit=None):
         self.video_id = video_id
         self.save_path = str(save_path)
-        self.domain = os.getenv("CDN_DOMAIN", "vz-dc851587-83d.b-cdn.net")
+        self.manifest = manifest
+        self.duration = duration
+        self.profile = profile or QualityProfile()
+        # Admissão por espaço livre: chamada com o tamanho estimado (0 = desconhecido) antes de escrever
+        self.admit = admit
+        self.domain = CDN_DOMAIN
+        self.error = None  # motivo da última falha, para classificar no relatório
         
         # Cabeçalhos importantes que o yt-dlp precisa enviar
         self.referer = "https://iframe.mediadelivery.net/"
         self.origin = "https://iframe.mediadelivery.net"
 
+    @staticmethod
+    def _parse_progress(line: str, row):
+        def number(value):
+            try:
+                return float(value)
+            except ValueError:
+                return None  # o yt-dlp usa "NA" para campos desconhecidos
+
+        fields = [number(value) for value in line.split()[1:5]]
+        if len(fields) == 4:
+            downloaded, total, speed, eta = fields
+            PROGRESS.update(row, downloaded=int(downloaded) if downloaded is not None else None, total=total, speed=speed, eta=eta)
+
+    @property
+    def playlist_url(self):
+        return f"{CDN_BASE_URL}/{self.video_id}/playlist.m3u8"
+
+    def _admit(self, size: Optional[int] = None):
+        if self.admit is not None:
+            self.admit(size or 0)
+
+    def _remux(self, inputs: list, output: str, audio_only: bool = False):
+        cmd = ["ffmpeg", "-y", "-loglevel", "error"]
+        for path in inputs:
+            cmd += ["-i", str(path)]
+        for index in range(len(inputs)):
+            cmd += ["-map", f"{index}:a" if audio_only else f"{index}"]
+        cmd += ["-c", "copy"]
+        if any(str(path).endswith(".ts") for path in inputs):
+            cmd += ["-bsf:a", "aac_adtstoasc"]  # áudio ADTS do MPEG-TS precisa de conversão para MP4
+        cmd += ["-movflags", "+faststart", "-f", "mp4", output]
+        with METRICS.timer("ffmpeg", op="remux"):
+            completed = subprocess.run(cmd, check=False, capture_output=True, text=True)
+        if completed.returncode != 0:
+            raise RuntimeError(f"ffmpeg retornou código {completed.returncode}: {completed.stderr.strip()[:500]}")
+
+    def _already_downloaded(self):
+        if self.manifest is None:
+            return os.path.exists(self.save_path)
+        if self.manifest.is_done(self.save_path, self.video_id, str(self.profile)):
+            return True
+        # Arquivo baixado antes do manifesto existir (no perfil padrão): adota uma única vez e registra
+        if self.manifest.get(self.save_path) is None and os.path.exists(self.save_path) and self.profile.is_best:
+            self.manifest.mark_done_from_file(
+                self.save_path, "video", resource_id=self.video_id, expected_duration=self.duration, quality=str(self.profile),
+            )
+            return True
+        return False
+
     def download(self):
-        # 1. Verifica se o arquivo já existe
-        if os.path.exists(self.save_path):
+        # 1. Verifica no manifesto se a aula já foi concluída
+        if self._already_downloaded():
             print(f"\tArquivo já existe: {os.path.basename(self.save_path)}. Pulando.")
             return True
 
+        # Sem a master playlist, o tamanho é desconhecido: só o espaço livre mínimo é garantido
+        self._admit()
+        if self.manifest is not None:
+            self.manifest.mark(
+                self.save_path, "video", DownloadManifest.DOWNLOADING,
+                resource_id=self.video_id, expected_duration=self.duration, quality=str(self.profile), expected_size=None,
+            )
+
         print(f"Baixando com yt-dlp (CDN): {os.path.basename(self.save_path)}")
 
         # 2. Monta a URL da playlist
-        playlist_url = f"https://{self.domain}/{self.video_id}/playlist.m3u8"
+        playlist_url = self.playlist_url
         
         print(f"URL da playlist: {playlist_url}")  # Debug da URL da playlist
 
-        # 3. Monta o comando do yt-dlp em lista para evitar problemas de shell/quotes
+        # 3. Monta o comando do yt-dlp em lista para evitar problemas de shell/quotes.
+        # Sem --no-continue/--no-part: por padrão o yt-dlp já retoma os .part/.ytdl de execuções interrompidas
         ytdlp_args = [
             "yt-dlp",
             playlist_url,
@@ -170,107 +1948,687 @@ class CDNVideo:
             "--add-header", f"Origin: {self.origin}",
             "-o", self.save_path,
         ]
+        # Perfil de qualidade: sem ele, o yt-dlp escolhe a melhor variante da playlist
+        if self.profile.ytdlp_format():
+            ytdlp_args += ["-f", self.profile.ytdlp_format()]
+        # Chegando aqui com o arquivo final presente, ele é de um recurso antigo (vídeo
+        # substituído na plataforma) e precisa ser sobrescrito
+        if self.manifest is not None and os.path.exists(self.save_path):
+            ytdlp_args.append("--force-overwrites")
+        # O yt-dlp roda em outro processo: recebe uma fatia fixa do orçamento da CDN
+        bandwidth = RATE_GOVERNOR.bandwidth_for("cdn")
+        if bandwidth:
+            ytdlp_args += ["--limit-rate", str(max(1, int(bandwidth / max(1, self.workers))))]
+
+        # 4. Executa o comando lendo o progresso linha a linha (sem acumular a saída em memória)
+        ytdlp_args += ["--newline", "--progress-template", self.PROGRESS_TEMPLATE]
+        row = PROGRESS.current_row()
+        PROGRESS.update(row, engine=self.engine)
+        tail = deque(maxlen=50)  # últimas linhas, para diagnosticar falhas
+        try:
+            with METRICS.timer("yt-dlp"):
+                process = subprocess.Popen(
+                    ytdlp_args,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    text=True,
+                    errors="replace",
+                )
+                for line in process.stdout:
+                    if line.startswith("PROGRESS "):
+                        self._parse_progress(line, row)
+                    else:
+                        tail.append(line.rstrip())
+                returncode = process.wait()
+            if returncode == 0:
+                if self.profile.audio_only:
+                    # Sem rendição só de áudio, o yt-dlp baixa a menor variante com vídeo; como no
+                    # motor nativo, a trilha de vídeo é descartada
+                    audio_path = f"{self.save_path}.audio.mp4"
+                    self._remux([self.save_path], audio_path, audio_only=True)
+                    os.replace(audio_path, self.save_path)
+                print("✓ Download (CDN) concluído com sucesso!")
+                if self.manifest is not None:
+                    self.manifest.mark_done_from_file(self.save_path, "video")
+                return True
+            else:
+                print(f"✗ yt-dlp retornou código {returncode}.")
+                errors = [line for line in tail if "ERROR" in line] or list(tail)[-3:]
+                self.error = RuntimeError(f"yt-dlp retornou código {returncode}: {' | '.join(errors)[-500:]}")
+                if self.manifest is not None:
+                    self.manifest.mark(self.save_path, "video", DownloadManifest.FAILED)
+                if tail:
+                    print("Saída (últimas linhas):")
+                    print("\n".join(tail))
+                return False
+        except RuntimeError as e:
+            print(f"✗ Falha ao remover a trilha de vídeo: {e}")
+            self.error = e
+            if self.manifest is not None:
+                self.manifest.mark(self.save_path, "video", DownloadManifest.FAILED)
+            return False
+        except FileNotFoundError as e:
+            print("✗ yt-dlp não encontrado no PATH. Verifique a instalação.")
+            self.error = e
+            if self.manifest is not None:
+                self.manifest.mark(self.save_path, "video", DownloadManifest.FAILED)
+            return False
+    
+# Motor HLS nativo: baixa os segmentos da playlist em processo e remuxa com ffmpeg em uma passada
+class HLSVideo(CDNVideo):
+    engine = "hls"
+
+    def __init__(self, video_id: str, save_path: str, session, manifest: Optional[DownloadManifest] = None, duration: Optional[int] = None,
+                 profile: Optional[QualityProfile] = None, admit=None):
+        super().__init__(video_id, save_path, manifest, duration, profile, admit)
+        self.session = session
+        self.headers = {"Referer": self.referer, "Origin": self.origin}
+        # Os segmentos ficam ao lado do destino para permitir retomar após uma interrupção
+        self.work_dir = Path(f"{self.save_path}.hls")
+
+    def _fetch_playlist(self, url: str):
+        res = RATE_GOVERNOR.request(self.session, "GET", url, headers=self.headers, timeout=DEFAULT_TIMEOUT)
+        res.raise_for_status()
+        return load_m3u8().loads(res.text, uri=url)
+
+    def _select_variant(self, master):
+        # Perfil "best" segue o comportamento do yt-dlp: maior bitrate
+        return self.profile.select(master.playlists)
 
-        # 4. Executa o comando e verifica o resultado
+    @staticmethod
+    def _audio_rendition(variant):
+        # Áudio em rendição separada (EXT-X-MEDIA) do grupo da variante
+        return next((media for media in variant.media if media.type == "AUDIO" and media.uri), None)
+
+    def estimate(self, master, profile: Optional[QualityProfile] = None):
+        """Tamanho estimado do vídeo em um perfil a partir da master playlist já baixada."""
+        profile = profile or self.profile
+        if not master.is_variant:
+            return None
+        variant = profile.select(master.playlists)
+        return profile.estimate(variant, self.duration, separate_audio=self._audio_rendition(variant) is not None)
+
+    def _fetch_segment(self, url: str, target: Path, row=None):
+        if target.exists():
+            return  # segmento já baixado em uma execução interrompida
+        part = target.with_suffix(".part")
+        with RATE_GOVERNOR.request(self.session, "GET", url, headers=self.headers, timeout=DEFAULT_TIMEOUT, stream=True) as res:
+            res.raise_for_status()
+            with open(part, "wb") as f:
+                for chunk in res.iter_content(chunk_size=256 * 1024):
+                    RATE_GOVERNOR.consume_bytes(url, len(chunk))
+                    PROGRESS.add_bytes(len(chunk), row)
+                    f.write(chunk)
+        os.replace(part, target)
+
+    def _prepare_work_dir(self, sources: list):
+        """Cria a pasta dos segmentos com uma marca do que está sendo baixado. Segmentos de uma
+        execução interrompida só são reaproveitados se forem do mesmo recurso, perfil e variante:
+        a pasta é a mesma para qualquer recurso que vá para este destino (ex.: sem DEDUP)."""
+        marker = self.work_dir / "origem.json"
+        origin = {"resource": self.video_id, "quality": str(self.profile), "playlists": sources}
         try:
-            completed = subprocess.run(
-                ytdlp_args,
-                check=False,
-                capture_output=True,
-                text=True,
+            previous = json.loads(marker.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            previous = None
+        if previous != origin:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        if previous != origin:
+            marker.write_text(json.dumps(origin), encoding="utf-8")
+
+    @staticmethod
+    def _check_supported(playlist):
+        if any(key and key.method and key.method.upper() != "NONE" for key in playlist.keys):
+            raise RuntimeError("playlist criptografada não suportada pelo motor nativo")
+
+    def _download_track(self, playlist, work_dir: Path, name: str):
+        """Baixa todos os segmentos de uma media playlist e concatena em um único arquivo."""
+        urls = []
+        init_map = playlist.segment_map[0] if playlist.segment_map else None
+        if init_map is not None:
+            urls.append(init_map.absolute_uri)
+        urls.extend(segment.absolute_uri for segment in playlist.segments)
+
+        targets = [work_dir / f"{name}_{index:05d}.seg" for index in range(len(urls))]
+        # Os segmentos rodam em outras threads: a linha do painel é capturada aqui, no worker
+        row = PROGRESS.current_row()
+        with METRICS.timer("segments", track=name), ThreadPoolExecutor(max_workers=SEGMENT_WORKERS, thread_name_prefix="segmento") as executor:
+            list(executor.map(lambda url, target: self._fetch_segment(url, target, row), urls, targets))
+
+        track_path = work_dir / f"{name}.{'mp4' if init_map is not None else 'ts'}"
+        with METRICS.timer("disk", op="concat"), open(track_path, "wb") as out:
+            for target in targets:
+                with open(target, "rb") as f:
+                    shutil.copyfileobj(f, out)
+        return track_path
+
+    def download(self):
+        if self._already_downloaded():
+            print(f"\tArquivo já existe: {os.path.basename(self.save_path)}. Pulando.")
+            return True
+        if load_m3u8() is None:
+            print("✗ Biblioteca m3u8 não instalada; motor nativo indisponível.")
+            return False
+
+        print(f"Baixando com HLS nativo (CDN): {os.path.basename(self.save_path)}")
+        if self.manifest is not None:
+            self.manifest.mark(
+                self.save_path, "video", DownloadManifest.DOWNLOADING,
+                resource_id=self.video_id, expected_duration=self.duration, quality=str(self.profile), expected_size=None,
             )
-            if completed.returncode == 0:
-                print("✓ Download (CDN) concluído com sucesso!")
-                return True
+
+        work_dir = self.work_dir
+        try:
+            playlist = self._fetch_playlist(self.playlist_url)
+            media = []  # (nome da trilha, media playlist)
+            sources = [self.playlist_url]  # playlists de onde vêm os segmentos, para a marca da pasta
+            PROGRESS.update(PROGRESS.current_row(), engine=self.engine)
+            if playlist.is_variant:
+                variant = self._select_variant(playlist)
+                audio = self._audio_rendition(variant)
+                estimate = self.estimate(playlist)
+                if estimate:
+                    # Estimativa de tamanho para o painel: bitrate da variante × duração da aula
+                    PROGRESS.update(PROGRESS.current_row(), total=estimate)
+                    if self.manifest is not None:
+                        self.manifest.mark(self.save_path, "video", DownloadManifest.DOWNLOADING, expected_size=estimate)
+                # No perfil de áudio com rendição separada, a trilha de vídeo nem é baixada
+                if not (self.profile.audio_only and audio is not None):
+                    media.append(("video", self._fetch_playlist(variant.absolute_uri)))
+                    sources.append(variant.absolute_uri)
+                # Áudio em rendição separada (EXT-X-MEDIA) precisa entrar no mesmo remux
+                if audio is not None:
+                    media.append(("audio", self._fetch_playlist(audio.absolute_uri)))
+                    sources.append(audio.absolute_uri)
             else:
-                print(f"✗ yt-dlp retornou código {completed.returncode}.")
-                if completed.stderr:
-                    print("Stderr:")
-                    print(completed.stderr.strip())
-                if completed.stdout:
-                    print("Stdout (parcial):")
-                    print(completed.stdout.strip()[:2000])
-                return False
-        except FileNotFoundError:
-            print("✗ yt-dlp não encontrado no PATH. Verifique a instalação.")
+                media.append(("video", playlist))
+            for _, track in media:
+                self._check_supported(track)
+            # A estimativa reaproveita a master playlist já baixada (sem requisição extra)
+            self._admit(estimate if playlist.is_variant else None)
+
+            # Só depois das playlists aceitas: uma falha antes disso não deixa pasta vazia para trás
+            self._prepare_work_dir(sources)
+            tracks = [self._download_track(track, work_dir, name) for name, track in media]
+            tmp_output = f"{self.save_path}.tmp"
+            self._remux(tracks, tmp_output, audio_only=self.profile.audio_only)
+            os.replace(tmp_output, self.save_path)
+            shutil.rmtree(work_dir, ignore_errors=True)
+        except Exception as e:
+            print(f"✗ Falha no motor HLS nativo: {e}")
+            self.error = e
+            if self.manifest is not None:
+                self.manifest.mark(self.save_path, "video", DownloadManifest.FAILED)
             return False
-    
+
+        print("✓ Download (HLS nativo) concluído com sucesso!")
+        if self.manifest is not None:
+            self.manifest.mark_done_from_file(self.save_path, "video")
+        return True
+
 # Gerenciador de Downloads, vai instanciar as duas classes acima - ou somente uma delas, se indisponível
 class VideoDownloader:
-    def __init__(self, video_id: str, save_path: str):
+    def __init__(self, video_id: str, save_path: str, manifest: Optional[DownloadManifest] = None, duration: Optional[int] = None, session=None,
+                 profile: Optional[QualityProfile] = None, admit=None):
         self.video_id = video_id
         self.save_path = save_path
+        self.engine = None  # motor que concluiu o download (para o relatório)
+        self.error = None
         print(video_id, 'Dados dos vídeos em plaintext para Debug')
-        self.cdn = CDNVideo(video_id, save_path)
+        self.cdn = CDNVideo(video_id, save_path, manifest, duration, profile, admit)
+        # O motor nativo precisa de uma sessão HTTP compartilhada; sem ela, só o yt-dlp é usado
+        self.hls = HLSVideo(video_id, save_path, session, manifest, duration, profile, admit) if session is not None and VIDEO_ENGINE == "native" else None
 
     def download(self):
-        # A verificação de arquivo existente já é feita dentro de cada
-        # classe responsável (CDNVideo), então não precisamos dela aqui.
+        """Retorna True se o vídeo foi baixado agora ou já existia; `engine` fica None no segundo caso."""
+        # Já concluído (manifesto ou arquivo anterior a ele): nenhum motor é usado
+        if self.cdn._already_downloaded():
+            print(f"\tArquivo já existe: {os.path.basename(self.save_path)}. Pulando.")
+            return True
 
         print("--- Iniciando tentativa de download ---")
         
-        # 1. Se o download com Panda falhou (retornou False), tenta com CDN.
-        # print("\nFalha na fonte Panda. Tentando com a fonte CDN...")[DEPRECIADO]
+        # 1. Motor HLS nativo: evita iniciar um processo do yt-dlp por aula
+        if self.hls is not None and self.hls.download():
+            self.engine = self.hls.engine
+            print("-----------------------------------------")
+            return True
+
+        # 2. Fallback: yt-dlp via CDN
+        if self.hls is not None:
+            print("\nFalha no motor nativo. Tentando com o yt-dlp...")
         print("Realizando download das aulas via CDN, por favor, aguarde enquanto processamos os dados!")
         if self.cdn.download():
             # Se retornou True, o download foi bem-sucedido.
+            self.engine = self.cdn.engine
+            if self.hls is not None:
+                # Segmentos do motor nativo que falhou não servem para o arquivo do yt-dlp
+                shutil.rmtree(self.hls.work_dir, ignore_errors=True)
             print("-----------------------------------------")
-            return
+            return True
         
-        # 2. Se ambas as tentativas falharam.
+        # 3. Se ambas as tentativas falharam.
+        self.error = self.cdn.error or (self.hls.error if self.hls is not None else None)
+        if self.hls is not None and self.hls.error is not None and self.error is not self.hls.error:
+            # A mensagem do yt-dlp costuma ser genérica; o status HTTP do motor nativo fica na cadeia para a classificação
+            self.error.__cause__ = self.hls.error
         print("\n✗ Não foi possível baixar o vídeo de nenhuma das fontes disponíveis.")
         print("-----------------------------------------")
-    
+        return False
+
+# Verificação de integridade: ffprobe em um pool de processos, comparando a duração do
+# arquivo com a da aula; o resultado fica no manifesto para não verificar de novo
+class VideoVerifier:
+    def __init__(self, manifest: DownloadManifest, workers: int = VERIFY_WORKERS, tolerance: float = DURATION_TOLERANCE):
+        self.manifest = manifest
+        self.workers = max(1, workers)
+        self.tolerance = tolerance
+        self.available = VERIFY_ENABLED and shutil.which("ffprobe") is not None
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def is_verified(self, path):
+        row = self.manifest.get(path)
+        return bool(
+            row and row["state"] == DownloadManifest.DONE and row.get("verified_at")
+            and os.path.exists(path) and row["size"] in (None, os.path.getsize(path))
+        )
+
+    def _evaluate(self, path, probed, expected_duration):
+        """Compara e registra no manifesto; retorna (ok, motivo)."""
+        if probed is None:
+            ok, reason = False, "ffprobe não conseguiu ler o arquivo"
+        elif expected_duration and abs(probed - expected_duration) > max(self.tolerance, expected_duration * 0.01):
+            ok, reason = False, f"duração {probed:.1f}s, esperado {expected_duration}s"
+        else:
+            ok, reason = True, f"duração {probed:.1f}s"
+        row = self.manifest.get(path)
+        self.manifest.mark(
+            path, row["kind"] if row else "video", DownloadManifest.DONE if ok else DownloadManifest.FAILED,
+            probed_duration=probed, verified_at=time.time() if ok else None,
+        )
+        METRICS.inc("verify", result="ok" if ok else "mismatch")
+        return ok, reason
+
+    def verify(self, path, expected_duration: Optional[int] = None):
+        with METRICS.timer("verify"):
+            probed = self._pool().submit(probe_duration, str(path)).result()
+        return self._evaluate(path, probed, expected_duration)
+
+    def verify_many(self, items):
+        """Verifica vários arquivos em paralelo; `items` é uma lista de (caminho, duração esperada)."""
+        with METRICS.timer("verify", op="batch"):
+            probed = list(self._pool().map(probe_duration, [str(path) for path, _ in items]))
+        return [(path, *self._evaluate(path, duration, expected)) for (path, expected), duration in zip(items, probed)]
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+# Transcodificação opcional: cada preset gera uma cópia do vídeo verificado ("Aula.hevc.mp4") com o
+# ffmpeg em um pool de processos limitado por TRANSCODE_CPU; o estado fica no manifesto (kind "transcode")
+class VideoTranscoder:
+    # Preset: (encoder de vídeo exigido, argumentos de saída); "{threads}" recebe as threads por arquivo
+    PRESETS = {
+        "hevc": ("libx265", [
+            "-c:v", "libx265", "-crf", "28", "-preset", "medium", "-x265-params", "pools={threads}:log-level=error",
+            "-tag:v", "hvc1", "-c:a", "copy",
+        ]),
+        "av1": ("libsvtav1", ["-c:v", "libsvtav1", "-crf", "35", "-preset", "8", "-svtav1-params", "lp={threads}", "-c:a", "copy"]),
+        "mobile": ("libx264", [
+            "-vf", "scale=-2:'min(480,ih)'", "-c:v", "libx264", "-crf", "26", "-preset", "veryfast", "-c:a", "aac", "-b:a", "96k",
+        ]),
+        "mobile-hevc": ("libx265", [
+            "-vf", "scale=-2:'min(480,ih)'", "-c:v", "libx265", "-crf", "30", "-preset", "fast",
+            "-x265-params", "pools={threads}:log-level=error", "-tag:v", "hvc1", "-c:a", "aac", "-b:a", "64k",
+        ]),
+    }
+
+    def __init__(self, manifest: DownloadManifest, presets: str = TRANSCODE, cpu_budget: int = TRANSCODE_CPU,
+                 threads: int = TRANSCODE_THREADS):
+        self.manifest = manifest
+        self.presets = self.parse(presets)
+        self.cpu_budget = max(1, cpu_budget)
+        self.threads = max(1, min(threads, self.cpu_budget))
+        self.workers = max(1, self.cpu_budget // self.threads)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._encoders = None
+
+    @classmethod
+    def parse(cls, spec: str):
+        presets = [preset.strip().lower() for preset in (spec or "").split(",") if preset.strip()]
+        unknown = [preset for preset in presets if preset not in cls.PRESETS]
+        if unknown:
+            raise ValueError(f"Preset de transcodificação inválido: {', '.join(unknown)} (disponíveis: {', '.join(cls.PRESETS)})")
+        return list(dict.fromkeys(presets))
+
+    def unsupported(self):
+        """Presets cujo encoder não existe no ffmpeg instalado (ex.: build sem libsvtav1)."""
+        if self._encoders is None:
+            result = subprocess.run(["ffmpeg", "-hide_banner", "-encoders"], capture_output=True, text=True)
+            self._encoders = {line.split()[1] for line in result.stdout.splitlines() if len(line.split()) > 1}
+        return [preset for preset in self.presets if self.PRESETS[preset][0] not in self._encoders]
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=lower_priority)
+            return self._executor
+
+    @staticmethod
+    def output_path(path: Path, preset: str):
+        return path.with_name(f"{path.stem}.{preset}.mp4")
+
+    @staticmethod
+    def quality(profile: QualityProfile, preset: str):
+        """Valor da coluna "quality" de uma cópia: o perfil do vídeo de origem e o preset."""
+        return f"{profile}+{preset}"
+
+    def is_done(self, path, resource_id: str, quality: Optional[str] = None):
+        row = self.manifest.get(path)
+        return bool(
+            self.manifest.is_done(path, resource_id, quality)
+            and os.path.exists(path) and row["size"] in (None, os.path.getsize(path))
+        )
+
+    def transcode(self, source: Path, target: Path, preset: str, resource_id: str, duration: Optional[int] = None,
+                  quality: Optional[str] = None):
+        """Gera `target` a partir de `source` no pool de processos; retorna (tamanho, segundos)."""
+        _, arguments = self.PRESETS[preset]
+        partial = target.with_name(f"{target.stem}.parcial.mp4")
+        command = [
+            "ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-i", str(source), "-map", "0:v:0?", "-map", "0:a:0?",
+            *(argument.format(threads=self.threads) for argument in arguments),
+            "-threads", str(self.threads), "-movflags", "+faststart", str(partial),
+        ]
+        fields = dict(resource_id=resource_id, expected_duration=duration, quality=quality or preset)
+        self.manifest.mark(target, "transcode", DownloadManifest.DOWNLOADING, **fields)
+        start = time.perf_counter()
+        with METRICS.timer("transcode", preset=preset):
+            code, stderr = self._pool().submit(run_ffmpeg, command).result()
+        elapsed = time.perf_counter() - start
+        if code != 0 or not partial.exists():
+            partial.unlink(missing_ok=True)
+            self.manifest.mark(target, "transcode", DownloadManifest.FAILED, **fields)
+            raise RuntimeError(f"ffmpeg falhou na transcodificação ({preset}): {stderr or f'código {code}'}")
+        os.replace(partial, target)
+        size = target.stat().st_size
+        self.manifest.mark_done_from_file(target, "transcode", **fields)
+        METRICS.inc("transcode_bytes", size, preset=preset)
+        if duration:
+            METRICS.observe("transcode_speed", duration / elapsed if elapsed else 0, preset=preset)
+        return size, elapsed
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+# Agendador em pipeline: uma fila por etapa (metadados, materiais, vídeos e verificação),
+# cada uma com seu próprio limite de threads, para que arquivos pequenos não esperem atrás
+# dos vídeos e muitos materiais não tomem a banda dos vídeos
+class DownloadScheduler:
+    STAGES = ("metadata", "materials", "video", "move", "verify", "transcode")
+    THREAD_NAMES = {
+        "metadata": "metadados", "materials": "material", "video": "aula", "move": "movimentacao",
+        "verify": "verificacao", "transcode": "transcodificacao",
+    }
+
+    def __init__(self, workers: int = DEFAULT_WORKERS, metadata_workers: int = METADATA_WORKERS,
+                 material_workers: int = MATERIAL_WORKERS, verify_workers: int = VERIFY_WORKERS,
+                 move_workers: int = MOVE_WORKERS, transcode_workers: int = 1):
+        self.workers = max(1, workers)
+        self.limits = {
+            "metadata": max(1, metadata_workers), "materials": max(1, material_workers),
+            "video": self.workers, "move": max(1, move_workers), "verify": max(1, verify_workers),
+            "transcode": max(1, transcode_workers),
+        }
+        self._executors = {
+            stage: ThreadPoolExecutor(max_workers=limit, thread_name_prefix=self.THREAD_NAMES[stage])
+            for stage, limit in self.limits.items()
+        }
+        self._futures = []
+        self._lock = threading.Lock()
+
+    def submit(self, stage: str, fn, *args, **kwargs):
+        queued = time.perf_counter()
+
+        def run():
+            # Tempo na fila mostra qual etapa está limitando o pipeline
+            METRICS.observe("queue_seconds", time.perf_counter() - queued, stage=stage)
+            return fn(*args, **kwargs)
+
+        future = self._executors[stage].submit(run)
+        with self._lock:
+            self._futures.append(future)
+        return future
+
+    def submit_later(self, delay: float, fn, *args):
+        """Executa `fn` depois de `delay` segundos sem ocupar um worker; `wait()` também espera por ela."""
+        placeholder = Future()
+        with self._lock:
+            self._futures.append(placeholder)
+
+        def fire():
+            try:
+                placeholder.set_result(fn(*args))
+            except Exception as e:
+                placeholder.set_exception(e)
+
+        timer = threading.Timer(delay, fire)
+        timer.daemon = True
+        timer.start()
+        return placeholder
+
+    def wait(self):
+        """Aguarda todas as tarefas enviadas (inclusive as reenviadas por outras etapas) e encerra os pools."""
+        try:
+            while True:
+                with self._lock:
+                    pending = list(self._futures)
+                wait(pending)
+                with self._lock:
+                    if len(self._futures) == len(pending):
+                        break
+            for future in self._futures:
+                # As etapas já registram as falhas no relatório; aqui só evitamos exceções silenciosas
+                if future.exception():
+                    print(f"✗ Erro inesperado no worker: {future.exception()}")
+        finally:
+            for executor in self._executors.values():
+                executor.shutdown(wait=True)
+            self._futures = []
+
+# Uma aula no pipeline: conta as partes pendentes e chama `on_done` quando a última termina
+class LessonTask:
+    def __init__(self, job: dict, group_folder: Path, base_name: str, on_done, attempt: int = 0):
+        self.job = job
+        self.lesson = job["lesson"]
+        self.group_folder = group_folder
+        self.base_name = base_name
+        self.pending = 0
+        self.error = None  # falha de metadados ou vídeo: a aula entra como falha no relatório
+        self.verify_attempts = 0
+        self.materials_ok = True
+        self.material_error = None
+        self.attempt = attempt  # tentativas anteriores desta aula na fila de novas tentativas
+        self.engine = None
+        self.video_elapsed = None
+        self.video_size = None
+        self._on_done = on_done
+        self._lock = threading.Lock()
+
+    def add_parts(self, count: int = 1):
+        with self._lock:
+            self.pending += count
+
+    def part_done(self):
+        with self._lock:
+            self.pending -= 1
+            finished = self.pending == 0
+        if finished:
+            self._on_done(self)
+
 # Processo responsável por capturar os dados no site da Rocketseat [necessário refatorar]
 class Rocketseat:
-    def __init__(self):
-        self._session_exists = SESSION_PATH.exists()
-        if self._session_exists:
+    # Renovações de token seguidas por requisição antes de desistir
+    AUTH_ATTEMPTS = 3
+
+    def __init__(self, workers: int = DEFAULT_WORKERS, offline: bool = OFFLINE_MODE, sync: bool = SYNC_MODE,
+                 specialization_choice: Optional[int] = None, module_choices: Optional[str] = None,
+                 http2: bool = HTTP2_ENABLED, quality: str = QUALITY, transcode: str = TRANSCODE):
+        # O token salvo só é validado na primeira chamada à API; um 401 dispara a renovação
+        self.tokens = TokenStore()
+        if self.tokens.exists:
             print("Carregando sessão salva...")
-            self.session = pickle.load(SESSION_PATH.open("rb"))
-        else:
-            self.session = requests.session()
-            self.session.headers.update({
+        # As sessões HTTP são criadas na primeira requisição (respostas em cache não precisam delas)
+        self.http2 = http2
+        self.transport = None
+        self._session = None
+        self._connect_lock = threading.Lock()
+        self.timeout = DEFAULT_TIMEOUT
+        self.workers = workers
+        CDNVideo.workers = workers
+        self.offline = offline
+        self.sync = sync
+        # Comando `check`: só compara o plano com a última execução, sem baixar nada
+        self.check_only = False
+        self.pending_changes = 0
+        # Comando `estimate`: só calcula o tamanho dos vídeos pendentes em cada perfil de qualidade
+        self.estimate_only = False
+        self.quality = QualityProfile(quality)
+        # Modo coordenador/worker: fila compartilhada onde o plano é publicado ou de onde as aulas são reservadas
+        self.job_queue = None
+        self.publish_only = False
+        self.queue_owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._in_flight = {}
+        self._in_flight_lock = threading.Lock()
+        self._slot_freed = threading.Event()
+        # Escolhas pré-definidas (--formacao/--modulos) para execuções sem prompt, ex.: cron
+        self.specialization_choice = specialization_choice
+        self.module_choices = module_choices
+        # Na sincronização o cache sempre revalida com a API (ETag/If-Modified-Since)
+        self.cache = MetadataCache(ttl=0 if sync and not offline else CACHE_TTL)
+        self.manifest = DownloadManifest()
+        self.store = ContentStore() if DEDUP_ENABLED else None
+        # Disco de trabalho (SCRATCH_DIR) e admissão por espaço livre dos vídeos
+        self.scratch = SCRATCH_DIR
+        self.space = SpaceAdmission(parse_size(MIN_FREE_SPACE))
+        self._staging_locks = {}
+        self._staging_guard = threading.Lock()
+        self.verifier = VideoVerifier(self.manifest)
+        self.transcoder = VideoTranscoder(self.manifest, transcode)
+        self.scheduler = None
+        self.download_report = DownloadReport()
+        if not self.quality.is_best:
+            self.download_report.quality = str(self.quality)
+
+    def _connect(self):
+        with self._connect_lock:
+            if self._session is not None:
+                return
+            import requests
+
+            session = requests.session()
+            session.headers.update({
                 "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36",
                 "Referer": BASE_URL,
             })
-            # Configura retries e backoff para chamadas HTTP
-            retries = Retry(
-                total=5,
-                backoff_factor=0.3,
-                status_forcelist=(500, 502, 503, 504),
-                allowed_methods=("GET", "POST"),
-            )
-            adapter = HTTPAdapter(max_retries=retries)
-            self.session.mount("http://", adapter)
-            self.session.mount("https://", adapter)
-        self.timeout = DEFAULT_TIMEOUT
-        self.download_report = DownloadReport()
+            self.tokens.apply(session)
+            # Pools por host (API, site, CDN e materiais) dimensionados pelo número de workers
+            self.transport = Transport(self.workers, self.http2)
+            self._session = self.transport.configure_api_session(session)
 
-    def _get(self, url: str, **kwargs):
+    @property
+    def session(self):
+        if self._session is None:
+            self._connect()
+        return self._session
+
+    @property
+    def cdn_session(self):
+        if self._session is None:
+            self._connect()
+        return self.transport.cdn_session
+
+    def _request(self, method: str, url: str, **kwargs):
+        """Requisição autenticada: em 401 renova o token (uma vez para todos os workers) e repete."""
         kwargs.setdefault("timeout", self.timeout)
-        return self.session.get(url, **kwargs)
+        for _ in range(self.AUTH_ATTEMPTS):
+            generation = self.tokens.generation
+            response = RATE_GOVERNOR.request(self.session, method, url, **kwargs)
+            if response.status_code != 401 or not self.tokens.exists:
+                return response
+            if not self.tokens.refresh(self.session, generation, fallback=self._login_from_env):
+                return response
+            response.close()
+        return RATE_GOVERNOR.request(self.session, method, url, **kwargs)
+
+    def _get(self, url: str, **kwargs):
+        return self._request("GET", url, **kwargs)
 
     def _post(self, url: str, **kwargs):
-        kwargs.setdefault("timeout", self.timeout)
-        return self.session.post(url, **kwargs)
+        return self._request("POST", url, **kwargs)
+
+    def _login_from_env(self):
+        """Último recurso quando o refreshToken também expirou: novo login com as credenciais do ambiente."""
+        email, pwd = os.getenv("ROCKETSEAT_EMAIL"), os.getenv("ROCKETSEAT_PASSWORD")
+        if not (email and pwd):
+            print("Sessão expirada; remova o arquivo de sessão ou defina ROCKETSEAT_EMAIL/ROCKETSEAT_PASSWORD para entrar novamente.")
+            return False
+        self.login(email, pwd, quiet=True)
+        return True
+
+    def _get_cached(self, url: str, params: Optional[dict] = None, as_json: bool = True):
+        """GET com cache em disco: usa a entrada se estiver dentro do TTL, senão revalida
+        com If-None-Match/If-Modified-Since. No modo offline, responde apenas do cache."""
+        entry = self.cache.load(url, params)
+        if entry and (self.offline or self.cache.is_fresh(entry)):
+            return entry["body"]
+        if self.offline:
+            raise OfflineCacheMiss(f"Modo offline: resposta não encontrada no cache para {url}")
+
+        headers = {}
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+        res = self._get(url, params=params, headers=headers)
+        if res.status_code == 304 and entry:
+            self.cache.touch(entry)
+            return entry["body"]
+        res.raise_for_status()
+
+        if not as_json and "charset" not in res.headers.get("Content-Type", "").lower():
+            # Sem charset no cabeçalho o requests assume ISO-8859-1 para text/*; as páginas são UTF-8
+            res.encoding = "utf-8"
+        body = res.json() if as_json else res.text
+        self.cache.store(url, params, body, res.headers.get("ETag"), res.headers.get("Last-Modified"))
+        return body
     # Processo para validar credenciais, não adianta tentar baixar nada sem acesso legítimo ao conteúdo!
-    def login(self, username: str, password: str):
+    def login(self, username: str, password: str, quiet: bool = False):
         print("Realizando login...")
         payload = {"email": username, "password": password}
-        res = self._post(f"{BASE_API}/sessions", json=payload)
+        res = RATE_GOVERNOR.request(self.session, "POST", f"{BASE_API}/sessions", json=payload, timeout=self.timeout)
         res.raise_for_status()
-        data = res.json()
+        self.tokens.update(res.json())
+        self.tokens.apply(self.session)
 
-        self.session.headers["Authorization"] = f"{data['type'].capitalize()} {data['token']}"
-        self.session.cookies.update({
-            "skylab_next_access_token_v4": data["token"],
-            "skylab_next_refresh_token_v4": data["refreshToken"],
-        })
-        
-        account_infos = self._get(f"{BASE_API}/account").json()
-        print(f"Bem-vindo, {account_infos['name']}!")
-        pickle.dump(self.session, SESSION_PATH.open("wb"))
+        if not quiet:
+            account_infos = self._get(f"{BASE_API}/account").json()
+            print(f"Bem-vindo, {account_infos['name']}!")
     # Processo para recuperar dados presentes no site
     def __load_modules(self, specialization_slug: str):
         print(f"Buscando módulos para a formação: {specialization_slug}")
@@ -278,8 +2636,7 @@ class Rocketseat:
         
         # Get modules data from API
         url = f"{BASE_API}/v2/journeys/{specialization_slug}/progress/temp"
-        res = self._get(url)
-        res.raise_for_status()
+        progress_data = self._get_cached(url)
 
         modules_data = []
         print('Recebendo dados dos cursos disponíveis; lembre-se de que é necessário ter acesso legítimo para concluir o download!')
@@ -287,11 +2644,8 @@ class Rocketseat:
         # challenge: {slug: 'quiz-formacao-desenvolvimento-ia-estatistica'}
 
         try:
-            progress_data = res.json()
             modules_data = progress_data.get("nodes", [])
-
-            journey_url = f"https://app.rocketseat.com.br/journey/{specialization_slug}/contents"
-            html_content = self._get(journey_url).text
+            missing = []
 
             for module in modules_data:
                 if module.get("type") in ("cluster", "group"):
@@ -300,26 +2654,37 @@ class Rocketseat:
                     if cluster_slug:
                         print(f"Usando slug do módulo (type={module.get('type')}) como cluster_slug para {module.get('title', 'Sem título')}: {cluster_slug}")
                         module["cluster_slug"] = cluster_slug
-                        continue
-
-                    # 2) Fallback (mais frágil): varrer o HTML procurando links para classroom
-                    search_pattern = f'<a class="w-full" href="/classroom/'
-                    html_pos = html_content.find(search_pattern)
-                    if html_pos != -1:
-                        start_pos = html_pos + len(search_pattern)
-                        end_pos = html_content.find('"', start_pos)
-                        cluster_slug = html_content[start_pos:end_pos]
-                        print(f"Encontrado cluster_slug (fallback HTML) para módulo {module.get('title', 'Sem título')}: {cluster_slug}")
-                        module["cluster_slug"] = cluster_slug
-                        html_content = html_content[end_pos:]
                     else:
-                        print(f"Não encontrado cluster_slug para módulo {module.get('title', 'Sem título')}")
                         module["cluster_slug"] = None
+                        missing.append(module)
                 else:
                     print(f"Módulo {module.get('title', 'Sem título')} não é do tipo cluster/group")
                     module["cluster_slug"] = None
 
+            # 2) Fallback: links para /classroom/ na página da jornada, buscada só quando algum módulo não tem slug
+            if missing:
+                index = self._journey_index(specialization_slug)
+                known_slugs = [module["cluster_slug"] for module in modules_data if module.get("cluster_slug")]
+                matches = index.match(missing, known_slugs)
+                methods = {}
+                for position, module in enumerate(missing):
+                    if position in matches:
+                        module["cluster_slug"], method = matches[position]
+                        methods[method] = methods.get(method, 0) + 1
+                        print(f"Encontrado cluster_slug (página da jornada, por {JourneyIndex.METHODS[method]}) para módulo {module.get('title', 'Sem título')}: {module['cluster_slug']}")
+                    else:
+                        print(f"Não encontrado cluster_slug para módulo {module.get('title', 'Sem título')}")
+                for method, count in methods.items():
+                    METRICS.inc("journey_matches", count, method=method)
+                METRICS.inc("journey_unmatched", len(missing) - len(matches))
+                print(
+                    f"Página da jornada: {len(index.links)} links | {len(matches)}/{len(missing)} módulos sem slug casados "
+                    f"({', '.join(f'{count} por {JourneyIndex.METHODS[method]}' for method, count in methods.items()) or 'nenhum'})"
+                )
+
             print(f"Encontrados {len(modules_data)} módulos.")
+        except OfflineCacheMiss:
+            raise
         except Exception as e:
             print(f"Erro ao processar os módulos: {e}")
 
@@ -327,16 +2692,34 @@ class Rocketseat:
         print(f"Início: {time.strftime('%H:%M:%S')} | Busca pelos módulos concluída! | Número de módulos encontrados: {len(modules_data)} | Tempo executado: {elapsed_time:.2f} segundos")
         return modules_data
 
+    def _journey_index(self, specialization_slug: str):
+        """Índice dos links da página da jornada; fica no cache junto da página e só é refeito
+        quando o conteúdo dela muda."""
+        journey_url = f"{BASE_URL}/journey/{specialization_slug}/contents"
+        html_content = self._get_cached(journey_url, as_json=False)
+        digest = hashlib.sha256(html_content.encode("utf-8")).hexdigest()
+        index_params = {"index": JourneyIndex.__name__, "version": JourneyIndex.VERSION}
+        entry = self.cache.load(journey_url, index_params)
+        if entry and entry["body"].get("digest") == digest:
+            return JourneyIndex(entry["body"]["links"])
+
+        parse_start = time.perf_counter()
+        with METRICS.timer("discovery", op="journey-index"):
+            index = JourneyIndex.parse(html_content)
+        print(
+            f"Índice da página da jornada: {len(index.links)} links em {(time.perf_counter() - parse_start) * 1000:.1f} ms "
+            f"({len(html_content) / 1024:.0f} KB)"
+        )
+        self.cache.store(journey_url, index_params, {"digest": digest, "links": index.links})
+        return index
+
     def __load_lessons_from_cluster(self, cluster_slug: str):
         # Carrega as aulas de um nó específico (cluster ou group)
         print(f"Buscando lições para o nó: {cluster_slug}")
         url = f"{BASE_API}/journey-nodes/{cluster_slug}"
         
         try:
-            res = self._get(url)
-            res.raise_for_status()
-            
-            module_data = res.json()
+            module_data = self._get_cached(url)
             print(f"Resposta da API para o nó {cluster_slug}:")
             # print(json.dumps(module_data, indent=2)) # Debug completo da resposta da API <<<<<<<<<----------
             
@@ -359,6 +2742,8 @@ class Rocketseat:
                         if "last" in lesson and lesson["last"]:
                             lesson_data = lesson["last"]
                             lesson_data["group_title"] = group_title
+                            # Identificador estável da aula (não da versão em "last"), usado na sincronização incremental
+                            lesson_data["lesson_key"] = lesson.get("id") or lesson.get("slug") or lesson_data.get("slug")
                             print(f"Adicionando aula: {lesson_data.get('title', 'Sem título')}")
                             group_lessons.append(lesson_data)
 
@@ -376,6 +2761,8 @@ class Rocketseat:
                     if "last" in lesson and lesson["last"]:
                         lesson_data = lesson["last"]
                         lesson_data["group_title"] = group_title
+                        # Identificador estável da aula (não da versão em "last"), usado na sincronização incremental
+                        lesson_data["lesson_key"] = lesson.get("id") or lesson.get("slug") or lesson_data.get("slug")
                         print(f"Adicionando aula: {lesson_data.get('title', 'Sem título')}")
                         group_lessons.append(lesson_data)
 
@@ -384,147 +2771,734 @@ class Rocketseat:
             
             print(f"\nEncontrados {len(groups)} grupos com um total de {sum(len(g['lessons']) for g in groups)} lições")
             return groups
+        except OfflineCacheMiss:
+            # Sem as aulas do módulo, o plano (e o `check`) o daria como removido
+            raise
         except Exception as e:
             print(f"Erro ao buscar lições do cluster {cluster_slug}: {e}")
             return []
 
-    def _download_video(self, video_id: str, save_path: Path):
-        VideoDownloader(video_id, str(save_path / "aulinha.mp4")).download()
+    def _download_file(self, url: str, dest: Path, chunk_size: int = 1024 * 1024):
+        """Baixa um arquivo em streaming para `dest.part` e renomeia atomicamente ao final.
 
-    def _download_lesson(self, lesson: dict, save_path: Path, group_index: int, lesson_index: int):
-        if isinstance(lesson, dict) and 'title' in lesson:
-            title = lesson.get('title', 'Sem título')
-            group_title = lesson.get('group_title', 'Sem Grupo')
-            print(f"\tBaixando aula {group_index}.{lesson_index}: {title} (Grupo: {group_title})")
-            
-            try:
-                # Criar pasta do grupo se não existir
-                group_folder = save_path / f"{group_index:02d}. {sanitize_string(group_title)}"
-                group_folder.mkdir(exist_ok=True)
-                
-                # Criar arquivo base com número sequencial do grupo
-                base_name = f"{lesson_index:02d}. {sanitize_string(title)}"
-                
-                # Salvar metadados em arquivo .txt
-                with open(group_folder / f"{base_name}.txt", "w", encoding="utf-8") as f:
-                    f.write(f"Grupo: {group_title}\n")
-                    f.write(f"Aula: {title}\n\n")
-                    
-                    # Adicionar descrição se existir
-                    if 'description' in lesson and lesson['description']:
-                        f.write(f"Descrição:\n{lesson['description']}\n\n")
-                    
-                    # Adicionar outras informações se existirem
-                    if 'duration' in lesson:
-                        minutes = lesson['duration'] // 60
-                        seconds = lesson['duration'] % 60
-                        f.write(f"Duração: {minutes}min {seconds}s\n")
-                    
-                    if 'author' in lesson and lesson['author'] and isinstance(lesson['author'], dict):
-                        author_name = lesson['author'].get('name', '')
-                        if author_name:
-                            f.write(f"Autor: {author_name}\n")
-                
-                # Baixar o vídeo se tiver resource
-                if 'resource' in lesson and lesson['resource']:
-                    resource = lesson["resource"].split("/")[-1] if "/" in lesson["resource"] else lesson["resource"]
-                    VideoDownloader(resource, str(group_folder / f"{base_name}.mp4")).download()
-                    self.download_report.add_success(group_title, title)
+        Um `.part` existente é retomado com Range/If-Range; um arquivo já presente com o
+        mesmo tamanho/ETag do servidor é apenas registrado. Retorna False quando nada foi baixado.
+        """
+        part_path = dest.with_name(dest.name + ".part")
+        row = self.manifest.get(dest) or {}
+
+        if dest.exists() and not part_path.exists():
+            # Arquivo sem registro (ou de outro recurso): confere com o servidor antes de baixar de novo
+            head = self._request("HEAD", url, allow_redirects=True)
+            remote_size = int(head.headers.get("Content-Length") or -1)
+            remote_etag = head.headers.get("ETag")
+            if head.ok and (remote_size == dest.stat().st_size or (remote_etag and remote_etag == row.get("etag"))):
+                self.manifest.mark_done_from_file(
+                    dest, "material", resource_id=url, expected_size=remote_size if remote_size >= 0 else None, etag=remote_etag,
+                )
+                return False
+
+        headers = {}
+        offset = part_path.stat().st_size if part_path.exists() else 0
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+            if row.get("etag"):
+                headers["If-Range"] = row["etag"]
+
+        with self._get(url, headers=headers, stream=True) as response:
+            if response.status_code == 416:
+                # O .part não corresponde mais ao arquivo remoto: recomeça do zero
+                part_path.unlink()
+                return self._download_file(url, dest, chunk_size)
+            response.raise_for_status()
+
+            digest = hashlib.sha256()
+            if response.status_code == 206:
+                with open(part_path, "rb") as f:
+                    for chunk in iter(lambda: f.read(chunk_size), b""):
+                        digest.update(chunk)
+                mode = "ab"
+            else:
+                offset = 0  # servidor ignorou o Range ou o arquivo mudou (If-Range)
+                mode = "wb"
+
+            length = response.headers.get("Content-Length")
+            # Com Content-Encoding o tamanho recebido não corresponde ao Content-Length
+            expected_size = offset + int(length) if length and not response.headers.get("Content-Encoding") else None
+            etag = response.headers.get("ETag") or row.get("etag")
+            self.manifest.mark(
+                dest, "material", DownloadManifest.DOWNLOADING,
+                resource_id=url, expected_size=expected_size, etag=etag,
+            )
+
+            size = offset
+            with open(part_path, mode) as f:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    RATE_GOVERNOR.consume_bytes(url, len(chunk))
+                    PROGRESS.add_bytes(len(chunk))
+                    f.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+
+        if expected_size is not None and size != expected_size:
+            raise IOError(f"download incompleto ({size} de {expected_size} bytes); será retomado na próxima execução")
+        os.replace(part_path, dest)
+        self.manifest.mark(
+            dest, "material", DownloadManifest.DONE,
+            resource_id=url, expected_size=expected_size, size=size, checksum=digest.hexdigest(), etag=etag,
+        )
+        return True
+
+    @staticmethod
+    def _lesson_paths(lesson: dict, save_path: Path, group_index: int, lesson_index: int):
+        """Pasta do grupo e nome base (sem extensão) dos arquivos da aula."""
+        group_folder = save_path / f"{group_index:02d}. {sanitize_string(lesson.get('group_title', 'Sem Grupo'))}"
+        # Criar arquivo base com número sequencial do grupo
+        return group_folder, f"{lesson_index:02d}. {sanitize_string(lesson.get('title', 'Sem título'))}"
+
+    @staticmethod
+    def _video_resource(lesson: dict):
+        return lesson["resource"].split("/")[-1] if "/" in lesson["resource"] else lesson["resource"]
+
+    def _job_video(self, job: dict):
+        """(caminho do vídeo, recurso) de uma aula do plano, ou None se ela não tem vídeo."""
+        lesson = job["lesson"]
+        if not lesson.get("resource"):
+            return None
+        group_folder, base_name = self._lesson_paths(lesson, job["save_path"], job["group_index"], job["lesson_index"])
+        return group_folder / f"{base_name}.mp4", self._video_resource(lesson)
+
+    def _video_pending(self, video_path: Path, resource: str):
+        """Mesmo critério do CDNVideo: concluído no manifesto (na pasta do curso ou no store) ou
+        arquivo anterior ao manifesto (só no perfil padrão) não precisam ser baixados."""
+        quality = str(self.quality)
+        if self.manifest.is_done(video_path, resource, quality):
+            return False
+        if self.store and self.manifest.is_done(self.store.path_for("video", resource + self.quality.store_key, ".mp4"), resource, quality):
+            return False
+        return not (self.quality.is_best and self.manifest.get(video_path) is None and video_path.exists())
+
+    def _pending_videos(self, jobs: list):
+        """Aulas do plano cujo vídeo ainda precisa ser baixado, como (job, recurso)."""
+        pending = []
+        for job in jobs:
+            video = self._job_video(job)
+            if video is not None and self._video_pending(*video):
+                pending.append((job, video[1]))
+        return pending
+
+    @staticmethod
+    def _lesson_materials(lesson: dict):
+        """Materiais de apoio da aula como (título, url); suporta variações comuns de chaves na API."""
+        materials = []
+        for download in lesson.get('downloads') or []:
+            download_url = download.get('file_url') or download.get('fileUrl') or download.get('url')
+            if download_url:
+                materials.append((download.get('title') or download.get('name') or 'arquivo', download_url))
+        return materials
+
+    def _stored(self, kind: str, key: str, dest: Path, fetch, variant: str = "", quality: Optional[str] = None):
+        """Baixa `key` uma única vez no store com `fetch(caminho)` e cria `dest` como link.
+        `variant` separa no store cópias diferentes do mesmo recurso (ex.: perfis de qualidade) e
+        `quality` é o perfil que a linha do manifesto de `dest` precisa ter para ser adotada.
+        Sem deduplicação (DEDUP=0), baixa direto em `dest`. Retorna o resultado de `fetch`."""
+        if self.store is None:
+            return fetch(dest)
+        store_path = self.store.path_for(kind, key + variant, dest.suffix)
+        with self.store.lock(store_path):
+            # Arquivo sem linha no manifesto só é adotado no perfil padrão (não se sabe em que perfil foi baixado)
+            adoptable = self.manifest.is_done(dest, key, quality) or (
+                self.manifest.get(dest) is None and quality in (None, QualityProfile().spec)
+            )
+            if not store_path.exists() and dest.exists() and adoptable:
+                # Baixado antes da deduplicação: o arquivo passa a ser a cópia do store. Sem linha
+                # no manifesto, `fetch` confere o arquivo como faria na pasta do curso
+                self.store.adopt(dest, store_path)
+                if self.manifest.get(dest) is not None:
+                    self.manifest.mark_like(store_path, dest)
+            reused = self.manifest.is_done(store_path, key, quality) and store_path.exists()
+            result = fetch(store_path)
+            if self.manifest.is_done(store_path, key, quality) and store_path.exists():
+                link_mode = "copy" if self._copy_current(store_path, dest) else self.store.link(store_path, dest)
+                self.manifest.mark_like(dest, store_path)
+                self.manifest.add_reference(dest, store_path, link_mode)
+                if reused:
+                    METRICS.inc("dedup_hits", kind=kind)
+                    METRICS.inc("dedup_bytes", store_path.stat().st_size, kind=kind)
                 else:
-                    print(f"\tAula '{title}' não tem recurso de vídeo")
-                    self.download_report.add_success(group_title, title)  # Considera sucesso mesmo sem vídeo
-                
-                # Baixar arquivos adicionais
-                if 'downloads' in lesson and lesson['downloads']:
-                    downloads_dir = group_folder / f"{base_name}_arquivos"
-                    downloads_dir.mkdir(exist_ok=True)
-                    
-                    for download in lesson['downloads']:
-                        # Suporta variações comuns de chaves na API
-                        download_url = (
-                            download.get('file_url') or
-                            download.get('fileUrl') or
-                            download.get('url')
-                        )
-
-                        if download_url:
-                            download_title = download.get('title') or download.get('name') or 'arquivo'
-                            file_ext = os.path.splitext(download_url)[1]
-
-                            download_path = downloads_dir / f"{sanitize_string(download_title)}{file_ext}"
-                            print(f"\t\tBaixando material: {download_title}")
-
-                            try:
-                                # Usa a sessão autenticada para downloads que possam exigir cookies/headers
-                                response = self._get(download_url)
-                                response.raise_for_status()
-
-                                with open(download_path, 'wb') as f:
-                                    f.write(response.content)
-
-                                print(f"\t\tMaterial salvo em: {download_path}")
-                            except Exception as e:
-                                print(f"\t\tErro ao baixar material: {e}")
-            except Exception as e:
-                self.download_report.add_failure(group_title, title, e)
-                print(f"\tErro ao baixar aula: {str(e)}")
+                    self._relink_references(store_path, dest)
+        return result
+
+    def _relink_references(self, store_path: Path, dest: Path):
+        """Arquivo do store substituído (ex.: vídeo reprovado na verificação e baixado de novo): os
+        hardlinks e cópias antigos continuam com o conteúdo anterior e são refeitos pelo índice `refs`."""
+        for path in map(Path, self.manifest.references(store_path)):
+            if path == dest or not (path.exists() or path.is_symlink()):
+                continue
+            link_mode = self.store.link(store_path, path)
+            self.manifest.mark_like(path, store_path)
+            self.manifest.add_reference(path, store_path, link_mode)
+            METRICS.inc("dedup_relinks")
+
+    def _copy_current(self, store_path: Path, dest: Path):
+        """Cópia (LINK_MODE=copy ou sistema de arquivos sem links) já feita a partir da versão atual
+        do arquivo do store: mesmo store_path no índice, mesmo checksum e mesmo tamanho."""
+        reference = self.manifest.reference(dest)
+        if reference is None or reference[1] != "copy" or reference[0] != str(store_path) or not dest.exists():
+            return False
+        store_row, dest_row = self.manifest.get(store_path), self.manifest.get(dest)
+        return bool(
+            store_row and dest_row and store_row["checksum"] and dest_row["checksum"] == store_row["checksum"]
+            and dest.stat().st_size == store_row["size"]
+        )
+
+    def _write_metadata(self, task: LessonTask):
+        """Etapa de metadados: grava o .txt da aula (só reescreve se o conteúdo mudou)."""
+        lesson = task.lesson
+        try:
+            lines = [f"Grupo: {lesson.get('group_title', 'Sem Grupo')}\n", f"Aula: {lesson.get('title', 'Sem título')}\n\n"]
+
+            # Adicionar descrição se existir
+            if 'description' in lesson and lesson['description']:
+                lines.append(f"Descrição:\n{lesson['description']}\n\n")
+
+            # Adicionar outras informações se existirem
+            if 'duration' in lesson:
+                minutes = lesson['duration'] // 60
+                seconds = lesson['duration'] % 60
+                lines.append(f"Duração: {minutes}min {seconds}s\n")
+
+            if 'author' in lesson and lesson['author'] and isinstance(lesson['author'], dict):
+                author_name = lesson['author'].get('name', '')
+                if author_name:
+                    lines.append(f"Autor: {author_name}\n")
+
+            metadata_path = task.group_folder / f"{task.base_name}.txt"
+            metadata_text = "".join(lines)
+            metadata_checksum = hashlib.sha256(metadata_text.encode("utf-8")).hexdigest()
+            metadata_row = self.manifest.get(metadata_path)
+            if not (metadata_row and metadata_row["state"] == DownloadManifest.DONE and metadata_row["checksum"] == metadata_checksum):
+                with open(metadata_path, "w", encoding="utf-8") as f:
+                    f.write(metadata_text)
+                self.manifest.mark(
+                    metadata_path, "metadata", DownloadManifest.DONE,
+                    resource_id=lesson.get('id'), size=len(metadata_text.encode("utf-8")), checksum=metadata_checksum,
+                )
+        except Exception as e:
+            task.error = task.error or e
+            print(f"\tErro ao salvar metadados de '{lesson.get('title', 'Sem título')}': {e}")
+        finally:
+            task.part_done()
+
+    def _download_material(self, task: LessonTask, download_title: str, download_url: str):
+        """Etapa de materiais: um material por tarefa, em paralelo com os vídeos."""
+        try:
+            downloads_dir = task.group_folder / f"{task.base_name}_arquivos"
+            downloads_dir.mkdir(exist_ok=True)
+            file_ext = os.path.splitext(download_url)[1]
+            download_path = downloads_dir / f"{sanitize_string(download_title)}{file_ext}"
+            if self.manifest.is_done(download_path, download_url) and download_path.exists():
+                print(f"\t\tMaterial já baixado: {download_title}. Pulando.")
+                return
+
+            def fetch(target: Path):
+                if self.manifest.is_done(target, download_url) and target.exists():
+                    return False  # já está no store (outra formação/curso)
+                print(f"\t\tBaixando material: {download_title}")
+                try:
+                    with METRICS.timer("material"):
+                        return self._download_file(download_url, target)
+                except Exception:
+                    self.manifest.mark(target, "material", DownloadManifest.FAILED, resource_id=download_url)
+                    raise
+
+            if self._stored("material", download_url, download_path, fetch):
+                print(f"\t\tMaterial salvo em: {download_path}")
+            else:
+                print(f"\t\tMaterial já baixado: {download_title}. Pulando.")
+        except Exception as e:
+            # Com algum material pendente, a aula continua "alterada" para a próxima sincronização
+            task.materials_ok = False
+            task.material_error = task.material_error or e
+            print(f"\t\tErro ao baixar material: {e}")
+        finally:
+            task.part_done()
+
+    @contextmanager
+    def _staging_lock(self, staged: Path):
+        """Um download por arquivo do disco de trabalho (aulas que compartilham o mesmo vídeo)."""
+        with self._staging_guard:
+            lock = self._staging_locks.setdefault(str(staged), threading.Lock())
+        with lock:
+            yield
+
+    def _admission(self, paths: list, reservations: list):
+        """Callback de admissão por espaço livre dos motores de vídeo: reserva uma única vez por aula
+        (o fallback para o yt-dlp não reserva de novo); quem chama libera as reservas da lista.
+        A maior estimativa já pedida vale para os próximos motores: o yt-dlp não conhece o tamanho,
+        e um motor nativo recusado por falta de espaço não pode deixá-lo entrar reservando 0 bytes."""
+        if not self.space.min_free:
+            return None
+        estimate = [0]
+
+        def admit(size: int):
+            estimate[0] = max(estimate[0], size)
+            if not reservations:
+                reservations.append(self.space.reserve(estimate[0], paths))
+        return admit
+
+    def _release(self, reservations: list):
+        for reservation in reservations:
+            self.space.release(reservation)
+        reservations.clear()
+
+    def _record_video(self, task: LessonTask, downloader, path: Path, video_start: float):
+        task.video_elapsed = time.time() - video_start
+        if not downloader.ok:
+            raise RuntimeError(f"não foi possível baixar o vídeo ({downloader.error or 'sem detalhes'})") from downloader.error
+        task.engine = downloader.engine
+        if downloader.engine:
+            task.video_size = path.stat().st_size
+            METRICS.observe("video_seconds", task.video_elapsed, engine=downloader.engine)
+            METRICS.observe("video_mbps", task.video_size / task.video_elapsed / (1024 * 1024), engine=downloader.engine)
+            if downloader.engine == CDNVideo.engine:
+                # Bytes do yt-dlp não passam pelo RateGovernor deste processo
+                METRICS.inc("bytes", task.video_size, budget="cdn")
+
+    def _after_video(self, task: LessonTask, video_path: Path, resource: str):
+        if self.verifier.available and not self.verifier.is_verified(video_path):
+            # A verificação roda na sua própria fila; a aula só termina depois dela
+            task.add_parts(1)
+            self.scheduler.submit("verify", self._verify_video, task, video_path, resource)
         else:
-            print(f"\tFormato de aula não reconhecido: {lesson}")
+            self._queue_transcode(task, video_path, resource)
 
-    def _download_courses(self, specialization_slug: str, specialization_name: str):
-        print(f"Baixando cursos da especialização: {specialization_name}")
-        self.download_report.start()
-        
+    def _prepare_transcoder(self):
+        """Remove os presets que não podem rodar: perfil só de áudio, sem ffmpeg ou sem o encoder."""
+        transcoder = self.transcoder
+        if not transcoder.presets:
+            return
+        if self.quality.audio_only or shutil.which("ffmpeg") is None:
+            print("Transcodificação desativada (perfil só de áudio ou ffmpeg não encontrado).")
+            transcoder.presets = []
+            return
+        for preset in transcoder.unsupported():
+            print(f"Preset de transcodificação '{preset}' ignorado: o ffmpeg instalado não tem o encoder {transcoder.PRESETS[preset][0]}.")
+            transcoder.presets.remove(preset)
+        if transcoder.presets:
+            print(
+                f"Transcodificação ({', '.join(transcoder.presets)}): {transcoder.workers} processo(s) com "
+                f"{transcoder.threads} thread(s) cada (TRANSCODE_CPU={transcoder.cpu_budget})."
+            )
+
+    def _queue_transcode(self, task: LessonTask, video_path: Path, resource: str):
+        """Agenda as cópias transcodificadas que faltam; elas rodam junto com os downloads das outras aulas."""
+        for preset in self.transcoder.presets:
+            output = self.transcoder.output_path(video_path, preset)
+            if not self.transcoder.is_done(output, resource, self.transcoder.quality(self.quality, preset)):
+                task.add_parts(1)
+                self.scheduler.submit("transcode", self._transcode_video, task, video_path, resource, preset)
+
+    def _download_video(self, task: LessonTask):
+        """Etapa de vídeo: limitada pelo número de workers (--workers). Com SCRATCH_DIR, o vídeo é
+        baixado no disco de trabalho e a etapa de movimentação o leva ao destino em segundo plano."""
+        lesson = task.lesson
+        title = lesson.get('title', 'Sem título')
+        print(f"\tBaixando aula {task.job['group_index']}.{task.job['lesson_index']}: {title} (Grupo: {lesson.get('group_title', 'Sem Grupo')})")
+        PROGRESS.begin(title, lesson.get("duration"))
+        handed_off = False
+        reservations = []
         try:
-            modules = self.__load_modules(specialization_slug)
+            video_start = time.time()
+            video_path = task.group_folder / f"{task.base_name}.mp4"
+            resource = self._video_resource(lesson)
+            destination = self.store.directory if self.store else video_path.parent
+            # A reserva é feita pelo motor de vídeo, com a estimativa da master playlist que ele já baixou
+            admit = self._admission([destination] + ([self.scratch] if self.scratch else []), reservations)
 
-            print("\nEscolha os módulos que você quer baixar:")
-            print("[0] - Baixar todos os módulos")
-            for i, module in enumerate(modules, 1):
-                print(f"[{i}] - {module['title']}")
+            if self.scratch is None:
+                def fetch(target: Path):
+                    downloader = VideoDownloader(resource, str(target), self.manifest, lesson.get('duration'), self.cdn_session, self.quality, admit)
+                    downloader.ok = downloader.download()
+                    return downloader
 
-            choices = input("Digite 0 para baixar todos os módulos ou os números dos módulos separados por vírgula (ex: 1, 3, 5): ")
-            
-            if choices.strip() == "0":
-                selected_modules = modules
-                print("\nBaixando todos os módulos...")
+                downloader = self._stored("video", resource, video_path, fetch, self.quality.store_key, str(self.quality))
+                self._record_video(task, downloader, video_path, video_start)
+                self._after_video(task, video_path, resource)
+                return
+
+            staged = self.scratch / "videos" / f"{sanitize_string(resource + self.quality.store_key)}.mp4"
+            if self._video_pending(video_path, resource):
+                staged.parent.mkdir(parents=True, exist_ok=True)
+                with self._staging_lock(staged):
+                    # Já baixado no disco de trabalho (outra aula ou execução interrompida): só falta mover
+                    if not (self.manifest.is_done(staged, resource, str(self.quality)) and staged.exists()):
+                        downloader = VideoDownloader(resource, str(staged), self.manifest, lesson.get('duration'), self.cdn_session, self.quality, admit)
+                        downloader.ok = downloader.download()
+                        self._record_video(task, downloader, staged, video_start)
+            # A parte de vídeo da aula termina na etapa de movimentação
+            self.scheduler.submit("move", self._move_video, task, staged, video_path, resource, reservations)
+            handed_off = True
+        except Exception as e:
+            task.error = task.error or e
+            print(f"\tErro ao baixar aula: {str(e)}")
+        finally:
+            PROGRESS.end()
+            if not handed_off:
+                self._release(reservations)
+                task.part_done()
+
+    def _move_video(self, task: LessonTask, staged: Path, video_path: Path, resource: str, reservations: list):
+        """Etapa de movimentação: leva o vídeo do disco de trabalho para o destino (store ou pasta do
+        curso) e cria os links; limitada por MOVE_WORKERS para não saturar o destino."""
+        lesson = task.lesson
+        try:
+            def fetch(target: Path):
+                with self._staging_lock(staged):
+                    if staged.exists() and self.manifest.is_done(staged, resource, str(self.quality)):
+                        with METRICS.timer("move"):
+                            move_file(staged, target)
+                        METRICS.inc("bytes_moved", target.stat().st_size)
+                        self.manifest.rename(staged, target)
+                # Já no destino, pula; se o arquivo do disco de trabalho sumiu, baixa direto no destino
+                downloader = VideoDownloader(resource, str(target), self.manifest, lesson.get('duration'), self.cdn_session, self.quality)
+                downloader.ok = downloader.download()
+                return downloader
+
+            video_start = time.time()
+            downloader = self._stored("video", resource, video_path, fetch, self.quality.store_key, str(self.quality))
+            if downloader.engine or not downloader.ok:
+                self._record_video(task, downloader, video_path, video_start)
+            self._after_video(task, video_path, resource)
+        except Exception as e:
+            task.error = task.error or e
+            print(f"\tErro ao mover o vídeo da aula '{lesson.get('title', 'Sem título')}': {e}")
+        finally:
+            self._release(reservations)
+            task.part_done()
+
+    def _verify_video(self, task: LessonTask, video_path: Path, resource: str):
+        """Etapa de verificação: ffprobe no arquivo baixado; divergência volta para a fila de vídeos."""
+        title = task.lesson.get('title', 'Sem título')
+        try:
+            # Com deduplicação, verifica o arquivo do store e replica o resultado no link do curso
+            target = self.store.path_for("video", resource + self.quality.store_key, ".mp4") if self.store else video_path
+            ok, reason = self.verifier.verify(target, task.lesson.get('duration'))
+            if target != video_path:
+                self.manifest.mark_like(video_path, target)
+            if ok:
+                self._queue_transcode(task, video_path, resource)
+                return
+            if task.verify_attempts < VERIFY_RETRIES:
+                task.verify_attempts += 1
+                print(f"\t✗ Vídeo '{title}' reprovado na verificação ({reason}); baixando novamente...")
+                METRICS.inc("verify_retries")
+                task.add_parts(1)
+                self.scheduler.submit("video", self._download_video, task)
             else:
-                selected_modules = [modules[int(choice.strip()) - 1] for choice in choices.split(",")]
-
-            for module in selected_modules:
-                module_title = module["title"]
-                course_name = module.get("course", {}).get("title", "Sem Nome")
-                print(f"\nBaixando módulo: {module_title} do curso: {course_name}")
-                save_path = Path("Cursos") / specialization_name / sanitize_string(course_name) / sanitize_string(module_title)
-                save_path.mkdir(parents=True, exist_ok=True)
-
-                # Verifica se o módulo tem um cluster_slug
-                if "cluster_slug" in module and module["cluster_slug"]:
-                    cluster_slug = module["cluster_slug"]
-                    print(f"Usando cluster_slug: {cluster_slug}")
-                    
-                    # Obter grupos e aulas a partir do cluster_slug
-                    groups = self.__load_lessons_from_cluster(cluster_slug)
-                    
-                    if not groups:
-                        print(f"Nenhum grupo encontrado para o módulo: {module_title}")
-                        continue
-                    
-                    # Baixa cada grupo sequencialmente
-                    for group_index, group in enumerate(groups, 1):
-                        group_title = group["title"]
-                        print(f"\nProcessando grupo {group_index}: {group_title}")
-                        
-                        # Baixa cada aula do grupo
-                        for lesson_index, lesson in enumerate(group["lessons"], 1):
-                            self._download_lesson(lesson, save_path, group_index, lesson_index)
-                        
-                        print(f"Grupo {group_index} ({group_title}) concluído!")
+                print(f"\t✗ Vídeo '{title}' reprovado na verificação ({reason}).")
+                task.error = task.error or VerificationError(f"vídeo reprovado na verificação: {reason}")
+        except Exception as e:
+            task.error = task.error or e
+            print(f"\tErro ao verificar o vídeo '{title}': {e}")
+        finally:
+            task.part_done()
+
+    def _transcode_video(self, task: LessonTask, video_path: Path, resource: str, preset: str):
+        """Etapa de transcodificação: com deduplicação, a cópia fica no store uma única vez por preset."""
+        title, duration = task.lesson.get('title', 'Sem título'), task.lesson.get('duration')
+        try:
+            source = self.store.path_for("video", resource + self.quality.store_key, ".mp4") if self.store else video_path
+
+            quality = self.transcoder.quality(self.quality, preset)
+
+            def fetch(target: Path):
+                if self.transcoder.is_done(target, resource, quality):
+                    return
+                print(f"\tTranscodificando '{title}' ({preset})...")
+                size, elapsed = self.transcoder.transcode(source, target, preset, resource, duration, quality)
+                self.download_report.add_transcode(preset, source.stat().st_size, size, elapsed, duration)
+
+            output = self.transcoder.output_path(video_path, preset)
+            self._stored("video", resource, output, fetch, f"{self.quality.store_key}.{preset}", quality)
+        except Exception as e:
+            task.error = task.error or e
+            print(f"\tErro ao transcodificar o vídeo '{title}' ({preset}): {e}")
+        finally:
+            task.part_done()
+
+    @staticmethod
+    def _serialize_job(job: dict):
+        return {**job, "save_path": str(job["save_path"]), "order": list(job["order"])}
+
+    @staticmethod
+    def _deserialize_job(data: dict):
+        return {**data, "save_path": Path(data["save_path"]), "order": tuple(data["order"])}
+
+    def _finish_lesson(self, task: LessonTask):
+        """Chamado pela última etapa da aula: registra o resultado e a impressão digital.
+        Falhas transitórias voltam para a fila com backoff exponencial antes de virarem erro."""
+        lesson, job = task.lesson, task.job
+        title, group_title = lesson.get('title', 'Sem título'), lesson.get('group_title', 'Sem Grupo')
+        error = task.error or task.material_error
+        category = classify_failure(error) if error is not None else None
+        if error is not None and category in RETRYABLE_FAILURES and task.attempt < RETRY_ATTEMPTS:
+            delay = RETRY_BASE_DELAY * 2 ** task.attempt * random.uniform(0.8, 1.2)
+            print(f"\t↻ Falha em '{title}' ({FAILURE_CATEGORIES[category]}: {error}); nova tentativa em {delay:.1f}s")
+            METRICS.inc("lesson_retries", category=category)
+            # A aula inteira volta ao pipeline; metadados, materiais e vídeo já concluídos são pulados
+            self.scheduler.submit_later(delay, self._submit_job, job, task.attempt + 1)
+            return
+
+        if task.error is not None:
+            self.download_report.add_failure(group_title, title, task.error, job["order"], category)
+        else:
+            if not lesson.get('resource'):
+                print(f"\tAula '{title}' não tem recurso de vídeo")  # Considera sucesso mesmo sem vídeo
+            self.download_report.add_success(group_title, title, job["order"], task.engine, task.video_elapsed, task.video_size)
+            if task.materials_ok:
+                self.manifest.save_fingerprint(job["key"], job["save_path"], lesson_fingerprint(lesson))
+        if error is not None:
+            METRICS.inc("failures", category=category)
+            self.manifest.save_failure(job["key"], self._serialize_job(job), category, str(error), task.attempt + 1)
+        else:
+            self.manifest.clear_failure(job["key"])
+        PROGRESS.lesson_done(lesson.get("duration"))
+        if self.job_queue is not None:
+            self._release_job(job["key"], str(error) if task.error is not None else None)
+
+    def _release_job(self, key: str, error: Optional[str] = None):
+        """Modo worker: devolve a aula para a fila compartilhada e libera espaço para reservar outra."""
+        self.job_queue.complete(key, self.queue_owner, error)
+        with self._in_flight_lock:
+            self._in_flight.pop(key, None)
+        self._slot_freed.set()
+
+    def _select_modules(self, modules: list):
+        print("\nEscolha os módulos que você quer baixar:")
+        print("[0] - Baixar todos os módulos")
+        for i, module in enumerate(modules, 1):
+            print(f"[{i}] - {module['title']}")
+
+        choices = self.module_choices or input("Digite 0 para baixar todos os módulos ou os números dos módulos separados por vírgula (ex: 1, 3, 5): ")
+        
+        if choices.strip() == "0":
+            print("\nBaixando todos os módulos...")
+            return modules
+        return [modules[int(choice.strip()) - 1] for choice in choices.split(",")]
+
+    def _discover_lessons(self, selections: list):
+        """Fase de descoberta: busca todos os /journey-nodes selecionados em paralelo
+        e monta o plano completo de aulas antes de qualquer vídeo começar.
+
+        `selections` é uma lista de (nome da formação, módulos selecionados).
+        """
+        targets = []
+        for spec_index, (specialization_name, modules) in enumerate(selections, 1):
+            for module_index, module in enumerate(modules, 1):
+                if module.get("cluster_slug"):
+                    targets.append((spec_index, module_index, specialization_name, module))
                 else:
-                    print(f"Módulo não possui cluster_slug: {module_title}. Pulando.")
-                    continue
+                    print(f"Módulo não possui cluster_slug: {module['title']}. Pulando.")
+
+        print(f"\nDescobrindo aulas de {len(targets)} módulos ({DISCOVERY_WORKERS} requisições em paralelo)...")
+        start_time = time.time()
+        with METRICS.timer("discovery", op="journey-nodes"), ThreadPoolExecutor(max_workers=DISCOVERY_WORKERS, thread_name_prefix="descoberta") as executor:
+            all_groups = list(executor.map(
+                lambda target: self.__load_lessons_from_cluster(target[3]["cluster_slug"]),
+                targets,
+            ))
+
+        jobs = []
+        for (spec_index, module_index, specialization_name, module), groups in zip(targets, all_groups):
+            module_title = module["title"]
+            if not groups:
+                print(f"Nenhum grupo encontrado para o módulo: {module_title}")
+                continue
+
+            course_name = module.get("course", {}).get("title", "Sem Nome")
+            save_path = Path("Cursos") / specialization_name / sanitize_string(course_name) / sanitize_string(module_title)
+            # Os índices são fixados aqui, então a estrutura "NN. Grupo/NN. Aula"
+            # não depende da ordem de conclusão dos downloads
+            for group_index, group in enumerate(groups, 1):
+                for lesson_index, lesson in enumerate(group["lessons"], 1):
+                    jobs.append({
+                        "key": lesson.get("lesson_key") or str(save_path / f"{group_index:02d}" / f"{lesson_index:02d}"),
+                        "lesson": lesson,
+                        "save_path": save_path,
+                        "group_index": group_index,
+                        "lesson_index": lesson_index,
+                        "order": (spec_index, module_index, group_index, lesson_index),
+                    })
+
+        total_seconds = sum(job["lesson"].get("duration") or 0 for job in jobs)
+        total_materials = sum(len(job["lesson"].get("downloads") or []) for job in jobs)
+        print(
+            f"Plano montado em {time.time() - start_time:.2f} segundos | "
+            f"Aulas: {len(jobs)} | Materiais: {total_materials} | "
+            f"Duração total dos vídeos: {total_seconds // 3600}h {total_seconds % 3600 // 60}min"
+        )
+        return jobs
+
+    def _diff_jobs(self, jobs: list, apply: bool = True):
+        """Compara o plano com as impressões digitais da última execução e mantém só as
+        aulas novas ou com vídeo, materiais ou metadados alterados. Com `apply=False`
+        (comando `check`) o manifesto e o relatório não são alterados."""
+        previous = self.manifest.fingerprints()
+        changes = {"added": [], "resource": [], "materials": [], "metadata": [], "failed": [], "removed": [], "unchanged": []}
+        changed_jobs = []
+        for job in jobs:
+            label = f"{job['lesson'].get('group_title', 'Sem Grupo')} - {job['lesson'].get('title', 'Sem título')}"
+            fingerprint = lesson_fingerprint(job["lesson"])
+            old = previous.get(job["key"])
+            if old is None:
+                kind = "added"
+            elif old["resource"] != fingerprint["resource"]:
+                kind = "resource"
+            elif old["materials_hash"] != fingerprint["materials_hash"]:
+                kind = "materials"
+            elif old["metadata_hash"] != fingerprint["metadata_hash"]:
+                kind = "metadata"
+            elif self._job_video(job) and (self.manifest.get(self._job_video(job)[0]) or {}).get("state") == DownloadManifest.FAILED:
+                kind = "failed"  # ex.: reprovado pelo comando `verify`
+            else:
+                kind = "unchanged"
+            changes[kind].append(label)
+            if kind != "unchanged":
+                changed_jobs.append(job)
+
+        # Aulas que existiam nos módulos sincronizados e não vieram mais na resposta da API
+        crawled_modules = {str(job["save_path"]) for job in jobs}
+        current_keys = {job["key"] for job in jobs}
+        removed = [key for key, old in previous.items() if old["module_path"] in crawled_modules and key not in current_keys]
+        changes["removed"] = [f"{previous[key]['module_path']} ({key})" for key in removed]
+        if apply:
+            self.manifest.delete_fingerprints(removed)
+            self.download_report.set_changes(changes)
+        else:
+            self.pending_changes = len(changed_jobs) + len(removed)
+        print(
+            f"Sincronização: {len(changes['added'])} novas, {len(changes['resource'])} com vídeo alterado, "
+            f"{len(changes['materials'])} com materiais alterados, {len(changes['metadata'])} com metadados alterados, "
+            f"{len(changes['failed'])} com vídeo reprovado, "
+            f"{len(changes['removed'])} removidas, {len(changes['unchanged'])} sem alteração"
+        )
+        return changed_jobs
+
+    def _submit_job(self, job: dict, attempt: int = 0):
+        """Enfileira as etapas de uma aula (também usado pela fila de novas tentativas)."""
+        lesson = job["lesson"]
+        if not (isinstance(lesson, dict) and 'title' in lesson):
+            print(f"\tFormato de aula não reconhecido: {lesson}")
+            return False
+        group_folder, base_name = self._lesson_paths(lesson, job["save_path"], job["group_index"], job["lesson_index"])
+        group_folder.mkdir(parents=True, exist_ok=True)
+        task = LessonTask(job, group_folder, base_name, self._finish_lesson, attempt)
+        materials = self._lesson_materials(lesson)
+        # Todas as partes são contadas antes de enfileirar, para a aula não terminar cedo demais
+        task.add_parts(1 + len(materials) + (1 if lesson.get('resource') else 0))
+        self.scheduler.submit("metadata", self._write_metadata, task)
+        for download_title, download_url in materials:
+            self.scheduler.submit("materials", self._download_material, task, download_title, download_url)
+        if lesson.get('resource'):
+            self.scheduler.submit("video", self._download_video, task)
+        return True
+
+    def _download_jobs(self, jobs: list):
+        # FFmpeg/yt-dlp só são exigidos quando algum vídeo realmente vai ser baixado
+        if self._pending_videos(jobs):
+            check_dependencies()
+        self._prepare_transcoder()
+        scheduler = self.scheduler = DownloadScheduler(self.workers, transcode_workers=self.transcoder.workers)
+        if not self.verifier.available:
+            print("Verificação com ffprobe desativada (VERIFY=0 ou ffprobe não encontrado).")
+        print(
+            f"\nBaixando {len(jobs)} aulas em pipeline: {scheduler.limits['video']} vídeo(s), "
+            f"{scheduler.limits['materials']} material(is) e {scheduler.limits['metadata']} metadado(s) em paralelo..."
+        )
+        PROGRESS.start(len(jobs), sum(job["lesson"].get("duration") or 0 for job in jobs))
+        try:
+            for job in jobs:
+                self._submit_job(job)
+        finally:
+            scheduler.wait()
+            self.verifier.shutdown()
+            self.transcoder.shutdown()
+            PROGRESS.stop()
+
+    def _estimate_sizes(self, jobs: list):
+        """Estima, a partir das master playlists da CDN, o tamanho dos vídeos pendentes em cada
+        perfil de qualidade (bitrate da variante escolhida × duração da aula)."""
+        if load_m3u8() is None:
+            print("ERRO: a biblioteca m3u8 é necessária para ler as playlists (pip install m3u8).")
+            return {}
+        pending = self._pending_videos(jobs)
+        profiles = [QualityProfile(spec) for spec in QualityProfile.PRESETS]
+        if str(self.quality) not in QualityProfile.PRESETS:
+            profiles.append(self.quality)
+        print(f"\nLendo as playlists de {len(pending)} vídeo(s) pendente(s)...")
+
+        def estimate(item):
+            job, resource = item
+            video = HLSVideo(resource, "", self.cdn_session, duration=job["lesson"].get("duration"))
+            try:
+                master = video._fetch_playlist(video.playlist_url)
+            except Exception as e:
+                print(f"\tNão foi possível ler a playlist de '{job['lesson'].get('title')}': {e}")
+                return [None] * len(profiles)
+            return [video.estimate(master, profile) for profile in profiles]
+
+        with METRICS.timer("estimate"), ThreadPoolExecutor(max_workers=DISCOVERY_WORKERS, thread_name_prefix="estimativa") as executor:
+            results = list(executor.map(estimate, pending))
+
+        totals = {}
+        print(f"\nEstimativa de tamanho para {len(pending)} vídeo(s) pendente(s):")
+        for index, profile in enumerate(profiles):
+            sizes = [result[index] for result in results]
+            totals[str(profile)] = sum(size for size in sizes if size)
+            unknown = sum(1 for size in sizes if size is None)
+            marker = "  ← perfil atual" if str(profile) == str(self.quality) else ""
+            missing = f" ({unknown} sem bitrate/duração)" if unknown else ""
+            print(f"  {str(profile):>8}: {format_bytes(totals[str(profile)]):>10}{missing}{marker}")
+        return totals
+
+    def _download_courses(self, specializations: list):
+        """Baixa as formações escolhidas; `specializations` é uma lista de itens do catálogo."""
+        # Os módulos de todas as formações são buscados juntos; só a escolha é interativa
+        with METRICS.timer("discovery", op="modules"), ThreadPoolExecutor(max_workers=DISCOVERY_WORKERS, thread_name_prefix="descoberta") as executor:
+            all_modules = list(executor.map(lambda spec: self.__load_modules(spec["slug"]), specializations))
+
+        selections = []
+        for specialization, modules in zip(specializations, all_modules):
+            print(f"\nFormação: {specialization['title']}")
+            selections.append((specialization["title"], self._select_modules(modules)))
+
+        if self.check_only:
+            self._diff_jobs(self._discover_lessons(selections), apply=False)
+            return
+        if self.estimate_only:
+            self._estimate_sizes(self._discover_lessons(selections))
+            return
+        if self.publish_only:
+            jobs = self._discover_lessons(selections)
+            counts = self.job_queue.publish([self._serialize_job(job) for job in jobs])
+            print(
+                f"\n{len(jobs)} aulas publicadas em {self.job_queue.path}: {counts['pending']} pendente(s), "
+                f"{counts['leased']} em andamento, {counts['done']} concluída(s) e {counts['failed']} com falha."
+            )
+            return
+
+        self.download_report.start()
+        try:
+            jobs = self._discover_lessons(selections)
+            if self.sync:
+                jobs = self._diff_jobs(jobs)
+            with METRICS.timer("download"):
+                self._download_jobs(jobs)
         finally:
             self.download_report.finish()
+            jsonl_path, prom_path = METRICS.export()
+            print(f"Métricas salvas em: {jsonl_path} e {prom_path}")
 
     def select_specializations(self):
         print("Buscando especializações disponíveis...")
@@ -537,22 +3511,21 @@ class Rocketseat:
             "page": "1",
             "sort_by": "relevance",
         }
-        specializations = self._get(f"{BASE_API}/catalog/list", params=params).json()["items"]
-        clear_screen()
+        specializations = self._get_cached(f"{BASE_API}/catalog/list", params=params)["items"]
+        if not (self.check_only or self.estimate_only or self.publish_only):
+            clear_screen()
         print("Selecione uma formação ou 0 para selecionar todas:")
         for i, specialization in enumerate(specializations, 1):
             print(f"[{i}] - {specialization['title']}")
 
-        choice = int(input(">> "))
+        choice = self.specialization_choice if self.specialization_choice is not None else int(input(">> "))
         if choice == 0:
-            for specialization in specializations:
-                self._download_courses(specialization["slug"], specialization["title"])
+            self._download_courses(specializations)
         else:
-            specialization = specializations[choice - 1]
-            self._download_courses(specialization["slug"], specialization["title"])
+            self._download_courses([specializations[choice - 1]])
 
-    def run(self):
-        if not self._session_exists:
+    def _ensure_login(self):
+        if not self.tokens.exists and not self.offline:
             # Permite autenticar via variáveis de ambiente ou prompt (senha mascarada)
             email = os.getenv("ROCKETSEAT_EMAIL") or input("Seu email Rocketseat: ")
             try:
@@ -562,15 +3535,262 @@ class Rocketseat:
                 pwd = os.getenv("ROCKETSEAT_PASSWORD") or input("Sua senha: ")
 
             self.login(username=email, password=pwd)
+
+    def run(self):
+        self._ensure_login()
+        self.select_specializations()
+
+    def publish(self, queue_path: Path = JOB_QUEUE_PATH):
+        """Coordenador: faz a descoberta e publica as aulas na fila compartilhada, sem baixar nada."""
+        self.publish_only = True
+        self.job_queue = JobQueue(queue_path)
+        self._ensure_login()
+        self.select_specializations()
+
+    def _heartbeat(self, stop: threading.Event):
+        # Renova as reservas a cada terço do prazo; aulas ainda na fila de novas tentativas também contam
+        while not stop.wait(self.job_queue.lease / 3):
+            with self._in_flight_lock:
+                keys = list(self._in_flight)
+            try:
+                lost = self.job_queue.heartbeat(self.queue_owner, keys)
+            except sqlite3.Error as e:
+                print(f"\tFalha ao renovar as reservas na fila: {e}")
+                continue
+            for key in lost:
+                print(f"\tReserva da aula {key} vencida; outro worker pode baixá-la também.")
+
+    def work(self, queue_path: Path = JOB_QUEUE_PATH, keep_waiting: bool = False):
+        """Worker: reserva aulas da fila compartilhada e as baixa no pipeline local até a fila esvaziar
+        (com `keep_waiting`, continua aguardando novas publicações). Retorna a quantidade de falhas."""
+        queue = self.job_queue = JobQueue(queue_path)
+        self._ensure_login()
+        counts = queue.counts()
+        print(f"Worker {self.queue_owner} usando a fila {queue.path}: {counts['pending']} aula(s) pendente(s).")
+
+        self._prepare_transcoder()
+        scheduler = self.scheduler = DownloadScheduler(self.workers, transcode_workers=self.transcoder.workers)
+        # Só reserva o que cabe no pipeline (mais uma leva esperando), para a reserva não vencer na fila local
+        capacity = scheduler.limits["video"] * 2
+        dependencies_checked = False
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(stop,), name="heartbeat", daemon=True)
+        heartbeat.start()
+        # A duração total só é conhecida à medida que as aulas são reservadas; o ETA cobre as já reservadas
+        PROGRESS.start(counts["pending"], 0)
+        self.download_report.start()
+        try:
+            with METRICS.timer("download"):
+                while True:
+                    self._slot_freed.clear()
+                    with self._in_flight_lock:
+                        free = capacity - len(self._in_flight)
+                    jobs = [self._deserialize_job(job) for job in queue.claim(self.queue_owner, free)]
+                    PROGRESS.add_total(sum(job["lesson"].get("duration") or 0 for job in jobs))
+                    if jobs and not dependencies_checked and self._pending_videos(jobs):
+                        check_dependencies()
+                        dependencies_checked = True
+                    for job in jobs:
+                        with self._in_flight_lock:
+                            self._in_flight[job["key"]] = job
+                        if not self._submit_job(job):
+                            self._release_job(job["key"], "formato de aula não reconhecido")
+                    with self._in_flight_lock:
+                        busy = bool(self._in_flight)
+                    if not jobs and not busy and not keep_waiting:
+                        counts = queue.counts()
+                        # Reservas de outros workers ainda podem vencer e voltar para a fila
+                        if not counts["pending"] and not counts["leased"]:
+                            break
+                    self._slot_freed.wait(JobQueue.POLL_INTERVAL)
+        finally:
+            stop.set()
+            scheduler.wait()
+            self.verifier.shutdown()
+            self.transcoder.shutdown()
+            PROGRESS.stop()
+            self.download_report.finish()
+            jsonl_path, prom_path = METRICS.export()
+            print(f"Métricas salvas em: {jsonl_path} e {prom_path}")
+        counts = queue.counts()
+        print(f"Fila: {counts['done']} concluída(s), {counts['failed']} com falha, {counts['pending'] + counts['leased']} restante(s).")
+        return len(self.download_report.failed_downloads)
+
+    def retry_failed(self):
+        """Baixa de novo só as aulas registradas com falha no manifesto, sem refazer a descoberta.
+        Retorna a quantidade de aulas que continuam com falha."""
+        failures = self.manifest.failures()
+        if not failures:
+            print("Nenhuma aula com falha registrada.")
+            return 0
+        categories = {}
+        for failure in failures:
+            categories[failure["category"]] = categories.get(failure["category"], 0) + 1
+        print(f"Tentando novamente {len(failures)} aula(s) com falha:")
+        for category, count in categories.items():
+            print(f"  {FAILURE_CATEGORIES.get(category, category)}: {count}")
+
+        self._ensure_login()
+        jobs = sorted((self._deserialize_job(failure["job"]) for failure in failures), key=lambda job: job["order"])
+        self.download_report.start()
+        try:
+            with METRICS.timer("download"):
+                self._download_jobs(jobs)
+        finally:
+            self.download_report.finish()
+            jsonl_path, prom_path = METRICS.export()
+            print(f"Métricas salvas em: {jsonl_path} e {prom_path}")
+        return len(self.manifest.failures())
+
+    def verify(self, root: Path = Path("Cursos")):
+        """Confere com ffprobe, em paralelo, todos os vídeos de `root`, pulando os que o manifesto
+        já registra como verificados. Os reprovados são baixados de novo na próxima execução.
+        Retorna a quantidade de vídeos reprovados."""
+        if not self.verifier.available:
+            print("ERRO: ffprobe não encontrado (ele acompanha o FFmpeg) ou VERIFY=0.")
+            return 1
+        # Cópias transcodificadas também são conferidas; as interrompidas (.parcial.mp4) não
+        videos = sorted(path for path in root.rglob("*.mp4") if not path.name.endswith(".parcial.mp4"))
+        # Links do armazenamento deduplicado: cada arquivo do store é verificado uma única vez
+        store_of = {path: store_path for store_path, paths in self.manifest.references().items() for path in paths}
+        targets = {}
+        for path in videos:
+            if not self.verifier.is_verified(path):
+                targets.setdefault(Path(store_of.get(str(path), path)), []).append(path)
+        pending = sum(len(paths) for paths in targets.values())
+        print(
+            f"Verificando {pending} de {len(videos)} vídeos ({len(videos) - pending} já verificados) "
+            f"com {self.verifier.workers} processo(s)..."
+        )
+        items = [(target, (self.manifest.get(target) or self.manifest.get(paths[0]) or {}).get("expected_duration")) for target, paths in targets.items()]
+        failed = 0
+        try:
+            for target, ok, reason in self.verifier.verify_many(items):
+                for path in targets[target]:
+                    if path != target:
+                        self.manifest.mark_like(path, target)
+                    if not ok:
+                        failed += 1
+                        print(f"✗ {path}: {reason}")
+        finally:
+            self.verifier.shutdown()
+        print(f"Verificação concluída: {pending - failed} aprovados, {failed} reprovados.")
+        if failed:
+            print("Os vídeos reprovados serão baixados novamente na próxima execução (inclusive com --sync).")
+        return failed
+
+    def estimate(self):
+        """Mostra o tamanho estimado dos vídeos pendentes em cada perfil de qualidade, sem baixar."""
+        self.estimate_only = True
+        self._ensure_login()
+        self.select_specializations()
+
+    def check(self):
+        """Informa se há aulas novas, alteradas ou removidas desde a última execução.
+
+        Responde a partir do cache de metadados (só revalida entradas vencidas) e das
+        impressões digitais do manifesto; sem sessão salva, usa apenas o cache.
+        Retorna a quantidade de alterações encontradas.
+        """
+        self.check_only = True
+        if not self.tokens.exists:
+            self.offline = True
         self.select_specializations()
+        return self.pending_changes
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Downloader de Cursos da Rocketseat")
+    parser.add_argument(
+        "command", nargs="?", default="download",
+        choices=("download", "check", "verify", "retry-failed", "estimate", "publish", "worker"),
+        help="download (padrão) baixa as aulas; check só informa se há novidades (código de saída 10); "
+             "verify confere os vídeos de Cursos/ com ffprobe; retry-failed baixa de novo só as aulas com falha; "
+             "estimate mostra o tamanho dos vídeos pendentes em cada perfil de qualidade; "
+             "publish (coordenador) publica as aulas na fila compartilhada; worker baixa as aulas da fila",
+    )
+    parser.add_argument(
+        "-w", "--workers", type=int, default=DEFAULT_WORKERS,
+        help="quantidade de aulas baixadas em paralelo (padrão: DOWNLOAD_WORKERS ou 3)",
+    )
+    parser.add_argument(
+        "--offline", action="store_true", default=OFFLINE_MODE,
+        help="monta o plano apenas com dados do cache de metadados, sem chamar a API",
+    )
+    parser.add_argument(
+        "--formacao", type=int, default=None,
+        help="número da formação no menu (0 = todas), sem perguntar",
+    )
+    parser.add_argument(
+        "--modulos", default=None,
+        help='módulos de cada formação ("0" = todos ou "1, 3, 5"), sem perguntar',
+    )
+    parser.add_argument(
+        "--http2", action="store_true", default=HTTP2_ENABLED,
+        help="usa HTTP/2 com multiplexação na CDN (requer httpx[http2])",
+    )
+    parser.add_argument(
+        "--sync", action="store_true", default=SYNC_MODE,
+        help="sincronização incremental: baixa só aulas novas ou com vídeo/materiais alterados",
+    )
+    parser.add_argument(
+        "-q", "--qualidade", default=QUALITY,
+        help='perfil de qualidade dos vídeos: "best" (padrão), "1080p", "720p", "480p", "audio", '
+             'bitrate máximo ("2.5M") ou combinações ("720p,2M")',
+    )
+    parser.add_argument(
+        "--fila", type=Path, default=JOB_QUEUE_PATH,
+        help="arquivo SQLite da fila compartilhada dos comandos publish/worker (padrão: JOB_QUEUE ou fila.db)",
+    )
+    parser.add_argument(
+        "--aguardar", action="store_true",
+        help="no comando worker, continua aguardando novas aulas quando a fila esvazia",
+    )
+    parser.add_argument(
+        "--transcodificar", default=TRANSCODE,
+        help=f"gera cópias transcodificadas dos vídeos verificados, ex.: \"hevc,mobile\" "
+             f"(presets: {', '.join(VideoTranscoder.PRESETS)}; padrão: TRANSCODE, vazio = desativado)",
+    )
+    args = parser.parse_args(argv)
+    try:
+        QualityProfile(args.qualidade)
+        VideoTranscoder.parse(args.transcodificar)
+    except ValueError as e:
+        parser.error(str(e))
+    return args
 
 
 # Principal, vai chamar e executar tudo
 if __name__ == "__main__":
-    # 1. Executa a verificação de dependências primeiro
-    check_dependencies()
+    args = parse_args()
+
+    agent = Rocketseat(
+        workers=args.workers, offline=args.offline, sync=args.sync,
+        specialization_choice=args.formacao, module_choices=args.modulos, http2=args.http2,
+        quality=args.qualidade, transcode=args.transcodificar,
+    )
+    try:
+        if args.command == "check":
+            # Código de saída 10 quando há novidades, para uso em scripts/cron
+            sys.exit(10 if agent.check() else 0)
+        if args.command == "verify":
+            sys.exit(1 if agent.verify() else 0)
+        if args.command == "retry-failed":
+            sys.exit(1 if agent.retry_failed() else 0)
+        if args.command == "estimate":
+            agent.estimate()
+            sys.exit(0)
+        if args.command == "publish":
+            agent.publish(args.fila)
+            sys.exit(0)
+        if args.command == "worker":
+            sys.exit(1 if agent.work(args.fila, keep_waiting=args.aguardar) else 0)
 
-    # 2. Se tudo estiver OK, o resto do script continua
-    print("\nIniciando o processo de download...")
-    agent = Rocketseat()
-    agent.run()    
\ No newline at end of file
+        # FFmpeg e yt-dlp são verificados antes do primeiro vídeo a baixar
+        print("\nIniciando o processo de download...")
+        agent.run()
+    except OfflineCacheMiss as e:
+        # Ex.: `check` numa máquina sem sessão salva e sem cache, ou --offline sem ter rodado online antes
+        print(f"\n✗ {e}.")
+        print("Sem esses dados no cache não há como montar o plano offline: rode uma vez com login (sem --offline) para preenchê-lo.")
+        sys.exit(OFFLINE_CACHE_MISS_EXIT)